@@ -0,0 +1,264 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Engines computing the altitude and azimuth of sky positions from a site.
+Both engines take GPS times and ICRS ra/dec in degrees, broadcast against
+each other, and return alt, az in degrees:
+
+engine = altAzEngine.getEngine('numpy', EarthLocation.of_site('Palomar'))
+[alt, az] = engine.altaz(gpsTimes[:,None], ra[None,:], dec[None,:])
+
+'astropy' uses the full AltAz frame transformation. 'numpy' precesses the
+coordinates to the mean equinox of date (IAU 1976), computes the local mean
+sidereal time (IAU 1982) and rotates to the horizon. It ignores nutation,
+aberration, polar motion, UT1 - UTC and refraction, and assumes the current
+18 leap seconds between GPS and UTC, which costs about 0.01 degrees against
+astropy and is far below what altitude cuts at 20 and -18 degrees need.
+crossingTimes() and visibleIntervals() compute the times at which positions
+cross an altitude limit analytically from the hour angle equation, with the
+same approximations. Running this file prints a benchmark and accuracy report:
+
+python altAzEngine.py
+
+"""
+
+import time
+import numpy as np
+from astropy.time import Time
+from astropy import units as u
+from astropy.coordinates import SkyCoord, EarthLocation, AltAz
+
+import instrumentation
+
+
+GPS_EPOCH_JD = 2444244.5 ### 1980-01-06 00:00:00 UTC
+GPS_UTC_LEAP = 18.0 ### GPS - UTC in seconds since 2017-01-01
+J2000_JD = 2451545.0
+SIDEREAL_RATE = 360.98564736629 ### degrees per day
+
+
+def gps2jd(gps):
+	'''
+	Returns the (UTC) Julian date of GPS times.
+	'''
+	return GPS_EPOCH_JD + (np.asarray(gps, dtype='float64') - GPS_UTC_LEAP)/86400.
+
+
+def gmst(gps):
+	'''
+	Returns the Greenwich mean sidereal time in degrees (IAU 1982).
+	'''
+	d = gps2jd(gps) - J2000_JD
+	T = d/36525.
+	return np.mod(280.46061837 + SIDEREAL_RATE*d + 0.000387933*T**2
+				  - T**3/38710000., 360.0)
+
+
+def lst(gps, lon):
+	'''
+	Returns the local mean sidereal time in degrees at east longitude lon.
+	'''
+	return np.mod(gmst(gps) + lon, 360.0)
+
+
+def precess(gps, ra, dec):
+	'''
+	Precesses J2000 ra/dec (degrees) to the mean equinox of date (IAU 1976).
+	'''
+	T = (gps2jd(gps) - J2000_JD)/36525.
+	arcsec = np.pi/(180.*3600.)
+	zeta = (2306.2181*T + 0.30188*T**2 + 0.017998*T**3)*arcsec
+	z = (2306.2181*T + 1.09468*T**2 + 0.018203*T**3)*arcsec
+	theta = (2004.3109*T - 0.42665*T**2 - 0.041833*T**3)*arcsec
+	ra0 = np.deg2rad(ra) + zeta
+	dec0 = np.deg2rad(dec)
+	A = np.cos(dec0)*np.sin(ra0)
+	B = np.cos(theta)*np.cos(dec0)*np.cos(ra0) - np.sin(theta)*np.sin(dec0)
+	C = np.sin(theta)*np.cos(dec0)*np.cos(ra0) + np.cos(theta)*np.sin(dec0)
+	return [np.rad2deg(np.arctan2(A, B) + z), np.rad2deg(np.arcsin(np.clip(C, -1, 1)))]
+
+
+def hadec2altaz(ha, dec, lat):
+	'''
+	Returns alt, az (degrees, az east of north) from hour angle, declination
+	and latitude in degrees.
+	'''
+	ha = np.deg2rad(ha)
+	dec = np.deg2rad(dec)
+	lat = np.deg2rad(lat)
+	sinAlt = np.sin(dec)*np.sin(lat) + np.cos(dec)*np.cos(lat)*np.cos(ha)
+	alt = np.arcsin(np.clip(sinAlt, -1, 1))
+	az = np.arctan2(-np.cos(dec)*np.sin(ha),
+					np.sin(dec)*np.cos(lat) - np.cos(dec)*np.sin(lat)*np.cos(ha))
+	return [np.rad2deg(alt), np.mod(np.rad2deg(az), 360.0)]
+
+
+def crossingTimes(gps, ra, dec, lat, lon, altLimit):
+	'''
+	METHOD	:: Solves the hour angle equation
+			   cos H0 = (sin alt - sin lat sin dec)/(cos lat cos dec)
+			   for every position and returns the GPS times of the next
+			   rising above and setting below altLimit after gps, and the
+			   hour angle H0 (degrees). Positions that never rise get nan
+			   for both times and H0 = 0; positions that never set (always
+			   above altLimit) get nan for both times and H0 = 180.
+
+	gps		:: Start time (GPS seconds)
+	ra, dec	:: ICRS coordinates in degrees (arrays)
+	lat, lon:: Site latitude and east longitude in degrees
+	altLimit:: Altitude in degrees
+	'''
+	[raDate, decDate] = precess(gps, ra, dec)
+	phi = np.deg2rad(lat)
+	delta = np.deg2rad(decDate)
+	cosH0 = ((np.sin(np.deg2rad(altLimit)) - np.sin(phi)*np.sin(delta))
+			 /(np.cos(phi)*np.cos(delta)))
+	H0 = np.rad2deg(np.arccos(np.clip(cosH0, -1.0, 1.0)))
+	ha = lst(gps, lon) - raDate
+	crosses = np.abs(cosH0) < 1.0
+	setTime = np.where(crosses, gps + np.mod(H0 - ha, 360.0)/SIDEREAL_RATE*86400., np.nan)
+	riseTime = np.where(crosses, gps + np.mod(-H0 - ha, 360.0)/SIDEREAL_RATE*86400., np.nan)
+	return [riseTime, setTime, H0]
+
+
+def visibleIntervals(startTime, endTime, ra, dec, lat, lon, altLimit=20.0):
+	'''
+	METHOD		:: Returns the time intervals during which each position is
+				   above altLimit between two GPS times, as three arrays
+				   [index, start, end] with one entry per interval, sorted by
+				   index and start time.
+
+	startTime	:: Start of the window (GPS seconds)
+	endTime		:: End of the window (GPS seconds)
+	ra, dec		:: ICRS coordinates in degrees (arrays)
+	lat, lon	:: Site latitude and east longitude in degrees
+	altLimit	:: Altitude in degrees
+	'''
+	ra = np.atleast_1d(ra)
+	dec = np.atleast_1d(dec)
+	[riseTime, setTime, H0] = crossingTimes(startTime, ra, dec, lat, lon, altLimit)
+	siderealDay = 360.0/SIDEREAL_RATE*86400.
+	K = int(np.ceil((endTime - startTime)/siderealDay)) + 1
+	k = np.arange(K)*siderealDay
+	rises = riseTime[:,None] + k[None,:]
+	sets = setTime[:,None] + k[None,:]
+	### Positions that are up at the start set before they rise
+	up = setTime < riseTime
+	starts = np.where(up[:,None], np.column_stack([np.full(len(ra), startTime),
+												   rises[:,:-1]]), rises)
+	ends = sets
+	### Circumpolar positions are up for the whole window
+	always = H0 >= 180.0
+	starts[always, 0] = startTime
+	ends[always, 0] = endTime
+	starts = np.clip(starts, startTime, endTime)
+	ends = np.clip(ends, startTime, endTime)
+	index = np.repeat(np.arange(len(ra))[:,None], K, axis=1)
+	keep = ends > starts ### also drops the nan entries
+	return [index[keep], starts[keep], ends[keep]]
+
+
+class NumpyAltAz:
+	'''
+	Sidereal time plus rotation. See the module documentation for accuracy.
+
+	location	:: EarthLocation of the observatory
+	'''
+	name = 'numpy'
+
+	def __init__(self, location):
+		self.location = location
+		self.lat = location.lat.deg
+		self.lon = location.lon.deg
+
+	@instrumentation.instrumented('altaz')
+	def altaz(self, gps, ra, dec):
+		[raDate, decDate] = precess(gps, ra, dec)
+		return hadec2altaz(lst(gps, self.lon) - raDate, decDate, self.lat)
+
+
+class AstropyAltAz:
+	'''
+	The full astropy AltAz transformation.
+
+	location	:: EarthLocation of the observatory
+	'''
+	name = 'astropy'
+
+	def __init__(self, location):
+		self.location = location
+
+	@instrumentation.instrumented('altaz')
+	def altaz(self, gps, ra, dec):
+		gps, ra, dec = np.broadcast_arrays(gps, ra, dec)
+		coords = SkyCoord(ra=ra*u.degree, dec=dec*u.degree, frame='icrs')
+		frame = AltAz(obstime=Time(gps, format='gps'), location=self.location)
+		altAz = coords.transform_to(frame)
+		return [altAz.alt.deg, altAz.az.deg]
+
+
+engines = {'numpy': NumpyAltAz, 'astropy': AstropyAltAz}
+
+
+def getEngine(name, location):
+	'''
+	Returns the alt/az engine called name ('numpy' or 'astropy').
+	'''
+	if name not in engines:
+		raise ValueError('Unknown alt/az engine ' + repr(name) + ', use one of '
+						 + ', '.join(sorted(engines)))
+	return engines[name](location)
+
+
+def compareEngines(location, ntimes=100, ntiles=1000, startTime=1187008882.0,
+				   duration=365*86400., seed=0):
+	'''
+	METHOD		:: Benchmarks the engines on a grid of random times and tile
+				   positions and reports the accuracy of the numpy engine
+				   against astropy. Returns a dictionary with the run times
+				   (seconds) and the maximum and rms altitude and azimuth
+				   differences (degrees, azimuth only for alt > 10 deg).
+	'''
+	rng = np.random.RandomState(seed)
+	gps = startTime + rng.uniform(0, duration, ntimes)[:,None]
+	ra = rng.uniform(0, 360, ntiles)[None,:]
+	dec = np.rad2deg(np.arcsin(rng.uniform(-1, 1, ntiles)))[None,:]
+	report = {'ntimes': ntimes, 'ntiles': ntiles}
+	results = {}
+	for name in ['astropy', 'numpy']:
+		engine = getEngine(name, location)
+		start = time.time()
+		results[name] = engine.altaz(gps, ra, dec)
+		report[name + '_seconds'] = time.time() - start
+	dAlt = results['numpy'][0] - results['astropy'][0]
+	dAz = np.mod(results['numpy'][1] - results['astropy'][1] + 180.0, 360.0) - 180.0
+	dAz = dAz[results['astropy'][0] > 10.0]
+	report['alt_max_error'] = np.abs(dAlt).max()
+	report['alt_rms_error'] = np.sqrt(np.mean(dAlt**2))
+	report['az_max_error'] = np.abs(dAz).max()
+	report['az_rms_error'] = np.sqrt(np.mean(dAz**2))
+	report['speedup'] = report['astropy_seconds']/report['numpy_seconds']
+	return report
+
+
+if __name__ == '__main__':
+	palomar = EarthLocation.from_geodetic(-116.8639*u.degree, 33.3564*u.degree,
+										  1712.0*u.m)
+	report = compareEngines(palomar)
+	for key in sorted(report):
+		print(key + '\t' + str(report[key]))
@@ -4,24 +4,102 @@ import os
 
 
 
+class EventCatalog:
+        '''
+        The table of simulated events (2016_simulated_events.asc) parsed once
+        and indexed by event ID. The parsed columns are cached in a binary
+        sidecar file (<table>.npy) that is rebuilt whenever the ascii table is
+        newer than it.
+
+        path    :: The directory that contains the simulation ascii file and the
+                   2016_fits/ directory with the skymaps.
+        '''
+        def __init__(self, path, filename='2016_simulated_events.asc'):
+                self.path = path
+                self.filename = os.path.join(path, filename)
+                self.mtime = os.path.getmtime(self.filename)
+                self.data = self._load()
+                self.eventIDs = self.data['eventID']
+                self.index = dict([(str(eventID), row) for (row, eventID)
+                                   in enumerate(self.eventIDs)])
+
+        def _load(self):
+                sidecar = self.filename + '.npy'
+                if os.path.exists(sidecar) and os.path.getmtime(sidecar) >= self.mtime:
+                        return np.load(sidecar)
+
+                table = ascii.read(self.filename)
+                eventIDs = table['coinc-event-id'].data
+                data = np.zeros(len(table), dtype=[('eventID', eventIDs.dtype),
+                                                   ('RAdeg', 'f8'), ('DEdeg', 'f8'),
+                                                   ('distance', 'f8')])
+                data['eventID'] = eventIDs
+                data['RAdeg'] = table['RAdeg'].data
+                data['DEdeg'] = table['DEdeg'].data
+                data['distance'] = table['distance'].data
+                try:
+                        np.save(sidecar, data)
+                except (IOError, OSError):
+                        pass ### Read-only location, parse again next time
+                return data
+
+        def isStale(self):
+                return os.path.getmtime(self.filename) != self.mtime
+
+        def __len__(self):
+                return len(self.data)
+
+        def fitsFile(self, eventID):
+                return os.path.join(self.path, '2016_fits/') + str(eventID) + '/bayestar.fits.gz'
+
+        def rows(self, eventIDs):
+                '''
+                Returns the row numbers of the given event IDs, -1 for unknown IDs.
+                '''
+                return np.array([self.index.get(str(eventID), -1)
+                                 for eventID in np.atleast_1d(eventIDs)], dtype='int64')
+
+        def lookup(self, eventIDs):
+                '''
+                Bulk version of associate. Returns the arrays of RA, Dec and distance
+                of the injections and the array of paths to the skymaps for a list of
+                event IDs. Unknown IDs get nan and None.
+                '''
+                rows = self.rows(eventIDs)
+                found = rows >= 0
+                ra = np.full(len(rows), np.nan)
+                dec = np.full(len(rows), np.nan)
+                dist = np.full(len(rows), np.nan)
+                ra[found] = self.data['RAdeg'][rows[found]]
+                dec[found] = self.data['DEdeg'][rows[found]]
+                dist[found] = self.data['distance'][rows[found]]
+                fitsFiles = np.array([self.fitsFile(eventID) if ok else None for
+                                      (eventID, ok) in zip(np.atleast_1d(eventIDs), found)],
+                                     dtype=object)
+                return [ra, dec, dist, fitsFiles]
+
+
+_catalogs = {}
+
+def getCatalog(path):
+        '''
+        Returns the EventCatalog of the given path, parsing it only on first use
+        or if the ascii file has changed since.
+        '''
+        catalog = _catalogs.get(path)
+        if catalog is None or catalog.isStale():
+                catalog = _catalogs[path] = EventCatalog(path)
+        return catalog
+
 
 def associate(eventID, path):
         '''
         This function takes as input the event ID and the path to the ascii file and
         returns the RA, Dec and distance of the injection, and the path to the skymap.
         Make sure that the skymaps are in the same level of directory structure as the
-        simulation ascii file.
+        simulation ascii file. If the event is not found [nan, nan, nan, None] is
+        returned. Use getCatalog(path).lookup(eventIDs) for many events at once.
         '''
-        
-        data = ascii.read(os.path.join(path, '2016_simulated_events.asc'))
-
-        index = data['coinc-event-id'].data == eventID
-        if np.sum(index) == 0:
-                return [np.nan, np.nan, None]
-
-        event_RA = (data['RAdeg'].data)[index][0]
-        event_Dec = (data['DEdeg'].data)[index][0]
-        event_dist = (data['distance'].data)[index][0]
-        
-        fitsFile = os.path.join(path, '2016_fits/') + str(eventID) + '/bayestar.fits.gz'
-        return [event_RA, event_Dec, event_dist, fitsFile]
\ No newline at end of file
+
+        [ra, dec, dist, fitsFiles] = getCatalog(path).lookup([eventID])
+        return [ra[0], dec[0], dist[0], fitsFiles[0]]
@@ -0,0 +1,249 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Benchmarks of the alert-latency hot paths on synthetic inputs (see
+syntheticData.py): ZTF_RT, rankTiles, searchedArea, sourceTile, detectability,
+optimize_time, observationSchedule and eventSchedule. Every entry point is
+timed (best and mean of --repeat runs, starting from an empty shared cache so
+that reading the sky-map and the tile index is included) and then run once
+more under tracemalloc for its peak memory (Python 3 only). The results are
+written as JSON, and two result files can be compared:
+
+python benchmarks/runBenchmarks.py --nside 64 128 256 --output before.json
+python benchmarks/runBenchmarks.py --nside 64 128 256 --output after.json
+python benchmarks/runBenchmarks.py --compare before.json after.json
+
+Everything runs offline; the observatory is given by its coordinates.
+
+"""
+
+import os
+import sys
+import json
+import time
+import platform
+import argparse
+import subprocess
+import numpy as np
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None ### Python 2: no memory profile
+
+repoDir = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path.insert(0, repoDir)
+
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+
+import sharedCache
+import rankedTilesGenerator
+import instrumentModel
+import syntheticData
+
+
+palomar = EarthLocation.from_geodetic(-116.8639*u.degree, 33.3564*u.degree, 1712.0*u.m)
+eventTime = 1187008882.0
+
+
+def measure(func, repeat=3, cold=True):
+	'''
+	METHOD	:: Runs func repeat times and returns the best and mean run time
+			   (seconds) and the peak memory traced during one more run
+			   (bytes, None without tracemalloc). With cold, the shared cache
+			   is emptied before every run.
+	'''
+	times = []
+	for ii in range(repeat):
+		if cold: sharedCache.getCache().clear()
+		start = time.time()
+		func()
+		times.append(time.time() - start)
+	peak = None
+	if tracemalloc is not None:
+		if cold: sharedCache.getCache().clear()
+		tracemalloc.start()
+		func()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+	return {'best_seconds': min(times), 'mean_seconds': float(np.mean(times)),
+			'repeat': repeat, 'peak_bytes': peak}
+
+
+def quiet(func):
+	'''
+	Returns func with its printed output discarded.
+	'''
+	def run():
+		stdout = sys.stdout
+		sys.stdout = open(os.devnull, 'w')
+		try:
+			return func()
+		finally:
+			sys.stdout.close()
+			sys.stdout = stdout
+	return run
+
+
+def skyMapBenchmarks(skymap, nside, paths):
+	'''
+	Returns the benchmarks of the ranking entry points for one sky-map.
+	'''
+	prefix = paths['prefix']
+	rng = np.random.RandomState(0)
+	ra = rng.uniform(0, 360, 1000)
+	dec = np.rad2deg(np.arcsin(rng.uniform(-1, 1, 1000)))
+	generator = lambda: rankedTilesGenerator.RankedTileGenerator(skymap, prefix)
+	return [('ZTF_RT', lambda: generator().ZTF_RT(nside)),
+			('rankTiles_0.9', lambda: generator().rankTiles(nside, probability=0.9)),
+			('searchedArea', lambda: generator().searchedArea(ra[0], dec[0], nside)),
+			('searchedAreaBatch_1000', lambda: generator().searchedAreaBatch(ra, dec, nside)),
+			('sourceTile_1000', lambda: generator().sourceTile(ra, dec, paths['tiles'])),
+			('sourceTile_allTiles_1000', lambda: generator().sourceTile(ra, dec, paths['tiles'],
+																		nside, allTiles=True))]
+
+
+def detectabilityBenchmarks(paths):
+	'''
+	Returns the benchmarks of detectability and optimize_time.
+	'''
+	model = instrumentModel.InstrumentModel(*np.loadtxt(paths['limmag'], unpack=True))
+	rank = np.arange(100)[:,None,None,None]
+	timePerTile = np.linspace(60, 600, 50)[None,:,None,None]
+	totalTime = np.array([3600., 7200.])[None,None,:,None]
+	distance = np.linspace(1e7, 5e8, 100)[None,None,None,:]
+	probs = np.sort(np.random.RandomState(1).dirichlet(np.ones(400)*0.3))[::-1]
+	generator = rankedTilesGenerator.RankedTileGenerator.__new__(
+											rankedTilesGenerator.RankedTileGenerator)
+	return [('detectability_1M', lambda: rankedTilesGenerator.detectability(
+						rank, timePerTile, totalTime, -16.0, distance, model=model)),
+			('optimize_time_400', lambda: generator.optimize_time(
+						7200., -16.0, [0, 0.05], pValTiles=probs, model=model))]
+
+
+def scheduleBenchmarks(skymap, paths, duration, workdir):
+	'''
+	Returns the benchmarks of the schedulers (built once, outside the timing).
+	'''
+	scheduler = rankedTilesGenerator.Scheduler(skymap, site=palomar,
+								tileCoord=paths['tiles'], preCompFilePrefix=paths['prefix'],
+								ephemerisDir=os.path.join(workdir, 'ephemeris'),
+								engine='numpy')
+	scheduler.ephemeris.prefetch(eventTime, eventTime + duration + 86400.)
+	return [('observationSchedule', quiet(lambda: scheduler.observationSchedule(
+															duration, eventTime))),
+			('eventSchedule', lambda: scheduler.eventSchedule(duration, eventTime))]
+
+
+def gitCommit():
+	try:
+		with open(os.devnull, 'w') as devnull:
+			return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repoDir,
+										   stderr=devnull).decode().strip()
+	except (OSError, subprocess.CalledProcessError):
+		return None
+
+
+def runBenchmarks(nsides, workdir, repeat=3, ntiles=400, radius=2.5, duration=86400.,
+				  nproc=None):
+	'''
+	METHOD		:: Generates the inputs and runs all benchmarks. Returns the
+				   result dictionary with the keys meta and results (one
+				   record per benchmark, map and nside).
+	'''
+	paths = syntheticData.generate(workdir, nsides, ntiles, radius, nproc)
+	results = []
+	def record(name, func, mapName=None, nside=None, cold=True):
+		result = measure(func, repeat, cold)
+		result.update({'benchmark': name, 'map': mapName, 'nside': nside})
+		results.append(result)
+		print('%-26s %-10s %5s %10.4f s %12s bytes' % (name, mapName or '-', nside or '-',
+					result['best_seconds'], result['peak_bytes']))
+
+	for nside in nsides:
+		for mapName in ['gaussian', 'multilobe']:
+			skymap = paths['skymaps'][(mapName, nside)]
+			for name, func in skyMapBenchmarks(skymap, nside, paths):
+				record(name, func, mapName, nside)
+	for name, func in detectabilityBenchmarks(paths):
+		record(name, func)
+	nside = min(nsides)
+	for mapName in ['gaussian', 'multilobe']:
+		skymap = paths['skymaps'][(mapName, nside)]
+		for name, func in scheduleBenchmarks(skymap, paths, duration, workdir):
+			record(name, func, mapName, nside, cold=False)
+
+	meta = {'commit': gitCommit(), 'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+			'python': platform.python_version(), 'platform': platform.platform(),
+			'numpy': np.__version__, 'ntiles': ntiles, 'radius': radius,
+			'duration': duration}
+	return {'meta': meta, 'results': results}
+
+
+def compareResults(before, after, threshold=1.2):
+	'''
+	METHOD		:: Prints the ratio of the best times and peak memory of two
+				   result files and returns the number of benchmarks that got
+				   slower than threshold times the earlier result.
+	'''
+	key = lambda r: (r['benchmark'], r['map'], r['nside'])
+	old = dict([(key(r), r) for r in before['results']])
+	regressions = 0
+	for result in after['results']:
+		if key(result) not in old: continue
+		previous = old[key(result)]
+		timeRatio = result['best_seconds']/max(previous['best_seconds'], 1e-9)
+		memoryRatio = None
+		if result['peak_bytes'] and previous['peak_bytes']:
+			memoryRatio = float(result['peak_bytes'])/previous['peak_bytes']
+		flag = ''
+		if timeRatio > threshold:
+			flag = 'SLOWER'
+			regressions += 1
+		print('%-26s %-10s %5s time x%.2f memory %s %s' % (result['benchmark'],
+					result['map'] or '-', result['nside'] or '-', timeRatio,
+					'-' if memoryRatio is None else 'x%.2f' % memoryRatio, flag))
+	return regressions
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Benchmark the tiling and scheduling hot paths')
+	parser.add_argument('--nside', type=int, nargs='+', default=[64, 128, 256, 512, 1024, 2048])
+	parser.add_argument('--workdir', default='benchmark_data',
+						help='Directory for the generated inputs (reused between runs)')
+	parser.add_argument('--output', default='benchmark_results.json')
+	parser.add_argument('--repeat', type=int, default=3)
+	parser.add_argument('--ntiles', type=int, default=400)
+	parser.add_argument('--radius', type=float, default=2.5, help='Tile radius in degrees')
+	parser.add_argument('--duration', type=float, default=86400.,
+						help='Duration of the benchmarked schedules in seconds')
+	parser.add_argument('--nproc', type=int, default=None)
+	parser.add_argument('--compare', nargs=2, metavar=('BEFORE', 'AFTER'),
+						help='Compare two result files instead of running')
+	parser.add_argument('--threshold', type=float, default=1.2)
+	args = parser.parse_args()
+
+	if args.compare:
+		before, after = [json.load(open(filename)) for filename in args.compare]
+		sys.exit(1 if compareResults(before, after, args.threshold) else 0)
+
+	report = runBenchmarks(args.nside, args.workdir, args.repeat, args.ntiles,
+						   args.radius, args.duration, args.nproc)
+	with open(args.output, 'w') as output:
+		json.dump(report, output, indent=1)
+	print('Results written to ' + args.output)
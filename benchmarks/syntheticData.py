@@ -0,0 +1,117 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Synthetic inputs for the benchmarks, generated offline: sky-maps made of one
+or several gaussian lobes (Fisher distributions on the sphere), tile center
+files on a Fibonacci grid, the matching tile to pixel indices (built with
+tileFootprints.py) and a limiting magnitude table. Files that already exist
+in the work directory are reused.
+
+"""
+
+import os
+import sys
+import numpy as np
+import healpy as hp
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir))
+
+import tileFootprints
+
+
+### (ra, dec, sigma in degrees, weight) of the lobes
+gaussianLobes = [(150.0, 20.0, 3.0, 1.0)]
+multiLobeLobes = [(40.0, -30.0, 4.0, 0.5), (200.0, 35.0, 6.0, 0.3),
+				  (300.0, -60.0, 2.0, 0.2)]
+
+
+def lobeSkyMap(nside, lobes, chunkSize=2**20):
+	'''
+	Returns a normalized probability map (RING ordering) made of Fisher
+	distributions of the given widths, computed in chunks of pixels.
+	'''
+	npix = hp.nside2npix(nside)
+	skymap = np.empty(npix)
+	centers = [hp.ang2vec(0.5*np.pi - np.deg2rad(dec), np.deg2rad(ra))
+			   for (ra, dec, _, _) in lobes]
+	for start in range(0, npix, chunkSize):
+		pixels = np.arange(start, min(start + chunkSize, npix))
+		vec = np.array(hp.pix2vec(nside, pixels))
+		values = np.zeros(len(pixels))
+		for center, (_, _, sigma, weight) in zip(centers, lobes):
+			kappa = 1.0/np.deg2rad(sigma)**2
+			values += weight*kappa*np.exp(kappa*(np.dot(center, vec) - 1.0))
+		skymap[pixels] = values
+	return skymap/np.sum(skymap)
+
+
+def writeSkyMap(filename, nside, lobes):
+	if not os.path.exists(filename):
+		hp.write_map(filename, lobeSkyMap(nside, lobes), overwrite=True)
+	return filename
+
+
+def writeTileCenters(filename, ntiles):
+	'''
+	Writes ntiles tile centers on a Fibonacci grid (ID ra_center dec_center).
+	'''
+	if not os.path.exists(filename):
+		ii = np.arange(ntiles) + 0.5
+		dec = np.rad2deg(np.arcsin(1.0 - 2.0*ii/ntiles))
+		ra = np.mod(ii*180.0*(3.0 - np.sqrt(5.0)), 360.0)
+		np.savetxt(filename, np.column_stack([np.arange(1, ntiles + 1), ra, dec]),
+				   fmt=['%d', '%.6f', '%.6f'], header='ID ra_center dec_center',
+				   comments='')
+	return filename
+
+
+def writeLimitingMagnitudes(filename):
+	'''
+	Writes a table of limiting magnitude (and its error) against integration
+	time with the columns of timeMagnitude_new.dat.
+	'''
+	if not os.path.exists(filename):
+		times = np.logspace(np.log10(30.0), np.log10(3600.0), 12)
+		limmag = 20.5 + 1.25*np.log10(times/30.0)
+		error = 0.3 - 0.02*np.log(times/30.0)
+		np.savetxt(filename, np.column_stack([times, limmag, error]))
+	return filename
+
+
+def generate(workdir, nsides, ntiles=400, radius=2.5, nproc=None):
+	'''
+	METHOD		:: Generates all the inputs in workdir and returns their paths:
+				   a dictionary with the keys skymaps ({(map name, nside):
+				   file}), tiles, prefix (of the tile indices) and limmag.
+	'''
+	if not os.path.isdir(workdir):
+		os.makedirs(workdir)
+	paths = {'skymaps': {}}
+	for nside in nsides:
+		for name, lobes in [('gaussian', gaussianLobes), ('multilobe', multiLobeLobes)]:
+			filename = os.path.join(workdir, '%s_%d.fits' % (name, nside))
+			paths['skymaps'][(name, nside)] = writeSkyMap(filename, nside, lobes)
+	paths['tiles'] = writeTileCenters(os.path.join(workdir, 'tiles_%d.dat' % ntiles), ntiles)
+	paths['prefix'] = os.path.join(workdir, 'tiles_%d_r%.2f_pixel_indices_' % (ntiles, radius))
+	missing = [nside for nside in nsides
+			   if not os.path.exists(paths['prefix'] + str(nside) + '.offsets.npy')]
+	if missing:
+		tileFootprints.buildTileIndex(paths['tiles'], tileFootprints.Footprint(radius=radius),
+									  missing, paths['prefix'], nproc)
+	paths['limmag'] = writeLimitingMagnitudes(os.path.join(workdir, 'timeMagnitude.dat'))
+	return paths
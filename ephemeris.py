@@ -0,0 +1,180 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Sun and moon ephemeris tables for an observatory. The positions of the sun
+and the moon, their altitude and azimuth and the lunar illumination are
+computed with astropy once on a coarse time grid (default 10 minutes) and
+linearly interpolated in between. The tables are made per GPS day, so any
+time can be looked up, and if a cache directory is given every day table is
+saved there and reused by later events observed on the same nights. The day
+tables are kept in the process-wide cache (see sharedCache.py), one entry per
+day, so that they count towards its memory bound.
+
+eph = ephemeris.getEphemeris(EarthLocation.of_site('Palomar'), cacheDir='ephem')
+eph.sunAlt(gpsTimes)
+
+"""
+
+import os
+import numpy as np
+from astropy.time import Time
+from astropy.coordinates import get_sun, get_body, AltAz
+try:
+	from astropy.coordinates import get_moon
+except ImportError:
+	get_moon = lambda time: get_body('moon', time) ### Removed in astropy 6
+
+import sharedCache
+import instrumentation
+
+
+DAY = 86400.
+
+
+def lunarIllumination(Sun, Moon):
+	'''
+	Returns the illuminated fraction of the moon given the sun and moon
+	coordinates (with distances) at the same times.
+	'''
+	sunMoonAngle = Sun.separation(Moon)
+	phaseAngle = np.arctan2(Sun.distance*np.sin(sunMoonAngle),
+							Moon.distance - Sun.distance *
+							np.cos(sunMoonAngle))
+	return 0.5*(1.0 + np.cos(phaseAngle.value))
+
+
+class Ephemeris:
+	'''
+	Interpolated sun and moon tables for one site.
+
+	location	:: EarthLocation of the observatory
+	step		:: Spacing of the table in seconds. Must divide a day.
+	cacheDir	:: (optional) directory in which the day tables are stored
+	'''
+	columns = ['sun_ra', 'sun_dec', 'sun_alt', 'sun_az', 'moon_ra', 'moon_dec',
+			   'moon_alt', 'moon_az', 'illumination']
+	angles = ['sun_ra', 'sun_az', 'moon_ra', 'moon_az'] ### wrap at 360 degrees
+
+	def __init__(self, location, step=600., cacheDir=None):
+		self.location = location
+		self.step = float(step)
+		self.cacheDir = cacheDir
+		self.key = siteKey(location, step, cacheDir)
+		if cacheDir is not None and not os.path.isdir(cacheDir):
+			os.makedirs(cacheDir)
+
+	def _filename(self, day):
+		lon, lat, height = self.location.to_geodetic()[:3]
+		return os.path.join(self.cacheDir, 'ephemeris_%.5f_%.5f_%.1f_%d_%d.npz'
+							% (lat.deg, lon.deg, height.value, self.step, day))
+
+	@instrumentation.instrumented('ephemeris_compute')
+	def _compute(self, day):
+		gps = day*DAY + np.arange(0, DAY + self.step, self.step)
+		times = Time(gps, format='gps')
+		frame = AltAz(obstime=times, location=self.location)
+		Sun = get_sun(times)
+		Moon = get_moon(times)
+		altAz_sun = Sun.transform_to(frame)
+		altAz_moon = Moon.transform_to(frame)
+		table = {'time': gps, 'sun_ra': Sun.ra.deg, 'sun_dec': Sun.dec.deg,
+				 'sun_alt': altAz_sun.alt.deg, 'sun_az': altAz_sun.az.deg,
+				 'moon_ra': Moon.ra.deg, 'moon_dec': Moon.dec.deg,
+				 'moon_alt': altAz_moon.alt.deg, 'moon_az': altAz_moon.az.deg,
+				 'illumination': lunarIllumination(Sun, Moon)}
+		for name in self.angles:
+			table[name] = np.rad2deg(np.unwrap(np.deg2rad(table[name])))
+		return table
+
+	def _load(self, day):
+		filename = None
+		if self.cacheDir is not None:
+			filename = self._filename(day)
+		if filename is not None and os.path.exists(filename):
+			with instrumentation.stage('ephemeris_load'):
+				data = np.load(filename)
+				table = dict([(name, data[name]) for name in data.files])
+		else:
+			table = self._compute(day)
+			if filename is not None: np.savez(filename, **table)
+		return table
+
+	def _day(self, day):
+		return sharedCache.getCache().getOrCompute(self.key + (day,), self._load, day)
+
+	def prefetch(self, startTime, endTime):
+		'''
+		Computes (or loads) the tables for all days between two GPS times.
+		'''
+		for day in range(int(np.floor(startTime/DAY)), int(np.floor(endTime/DAY)) + 1):
+			self._day(day)
+
+	def interpolate(self, name, t):
+		'''
+		METHOD	:: Returns the column name (one of Ephemeris.columns) at the
+				   GPS time(s) t, interpolated linearly in the day tables.
+		'''
+		t = np.asarray(t, dtype='float64')
+		flat = np.atleast_1d(t)
+		days = np.floor(flat/DAY).astype('int64')
+		values = np.empty(len(flat))
+		for day in np.unique(days):
+			table = self._day(int(day))
+			sel = days == day
+			values[sel] = np.interp(flat[sel], table['time'], table[name])
+		if name in self.angles: values = np.mod(values, 360.0)
+		return values.reshape(t.shape) if t.ndim else values[0]
+
+	def sunAlt(self, t):
+		return self.interpolate('sun_alt', t)
+
+	def sunAltAz(self, t):
+		return [self.interpolate('sun_alt', t), self.interpolate('sun_az', t)]
+
+	def sun(self, t):
+		'''
+		Returns the ra and dec of the sun in degrees.
+		'''
+		return [self.interpolate('sun_ra', t), self.interpolate('sun_dec', t)]
+
+	def moon(self, t):
+		'''
+		Returns the ra and dec of the moon in degrees.
+		'''
+		return [self.interpolate('moon_ra', t), self.interpolate('moon_dec', t)]
+
+	def illumination(self, t):
+		return self.interpolate('illumination', t)
+
+
+def siteKey(location, step=600., cacheDir=None):
+	'''
+	Returns the cache key of the ephemeris of a site.
+	'''
+	lon, lat, height = location.to_geodetic()[:3]
+	return ('ephemeris', round(lat.deg, 5), round(lon.deg, 5), round(height.value, 1),
+			float(step), cacheDir)
+
+
+def getEphemeris(location, step=600., cacheDir=None):
+	'''
+	Returns the Ephemeris of a site from the process-wide cache, so that all
+	schedulers of the same site share the tables.
+	'''
+	return sharedCache.getCache().getOrCompute(siteKey(location, step, cacheDir),
+											   Ephemeris, location, step, cacheDir)
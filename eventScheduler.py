@@ -0,0 +1,170 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Event-driven scheduling engine. It produces the same kind of plan as
+Scheduler.observationSchedule (at every dark time slot, observe the most
+probable tile that is up and not yet observed) without stepping through
+every slot:
+
+* the time slots are processed one day at a time, with the dark slots of
+  the day found from the sun altitude track of the ephemeris,
+* the visibility interval of every tile is solved analytically
+  (altAzEngine.visibleIntervals) and the tiles enter a priority queue,
+  keyed on their rank, when they rise,
+* tiles that have set or were already observed are dropped lazily when
+  they reach the top of the queue, and when the queue is empty the engine
+  jumps straight to the next dark slot at which a tile rises.
+
+The cost is O(N log N) in the number of tiles plus a vectorized pass over
+the slots, so multi-night plans with thousands of tiles take milliseconds.
+The result is a structured array (see scheduleDtype).
+
+"""
+
+import heapq
+import numpy as np
+
+import altAzEngine
+
+
+DAY = 86400.
+
+scheduleDtype = [('time', 'f8'), ('tile', 'i8'), ('prob', 'f8'),
+				 ('sun_ra', 'f8'), ('sun_dec', 'f8'), ('moon_ra', 'f8'),
+				 ('moon_dec', 'f8'), ('illumination', 'f8')]
+
+
+def thresholdProbability(tileProbs, CI=0.99):
+	'''
+	Returns the probability of the last ranked tile needed to reach CI. As in
+	observationSchedule, only tiles more probable than this are scheduled.
+	'''
+	includeTiles = np.cumsum(tileProbs) < CI
+	includeTiles[min(np.sum(includeTiles), len(includeTiles) - 1)] = True
+	return tileProbs[includeTiles][-1]
+
+
+def daySlots(startTime, k0, nslots, step, ephemeris, sunAltLimit, prevDark):
+	'''
+	Returns the slot times startTime + (k0 + i)*step of one block, which of
+	them are dark, and the cost of every slot in units of step. As in
+	observationSchedule, every dark slot costs one step, the first day slot
+	after a night costs one step (the jump to the next sunset) and the other
+	day slots are free.
+	'''
+	slots = startTime + (k0 + np.arange(nslots))*step
+	dark = ephemeris.sunAlt(slots) < sunAltLimit
+	prev = np.append(prevDark, dark[:-1])
+	cost = (dark | prev).astype('int64')
+	return slots, dark, cost
+
+
+def makeSchedule(times, tiles, probs, ephemeris):
+	'''
+	Returns the structured schedule array with the sun/moon context of every
+	observation.
+	'''
+	schedule = np.zeros(len(times), dtype=scheduleDtype)
+	schedule['time'] = times
+	schedule['tile'] = tiles
+	schedule['prob'] = probs
+	if len(times):
+		[schedule['sun_ra'], schedule['sun_dec']] = ephemeris.sun(schedule['time'])
+		[schedule['moon_ra'], schedule['moon_dec']] = ephemeris.moon(schedule['time'])
+		schedule['illumination'] = ephemeris.illumination(schedule['time'])
+	return schedule
+
+
+def eventDrivenSchedule(tileIndices, tileProbs, ra, dec, location, ephemeris,
+						startTime, duration, integrationTime=120, CI=0.99,
+						tileAltLimit=20.0, sunAltLimit=-18.0):
+	'''
+	METHOD			 :: Computes the observation schedule of ranked tiles.
+						Returns the structured array (scheduleDtype) of the
+						scheduled observations in time order.
+
+	tileIndices		 :: Tile indices sorted by decreasing probability
+	tileProbs		 :: The (sorted) tile probabilities
+	ra, dec			 :: Tile centers in degrees, in the same order
+	location		 :: EarthLocation of the observatory
+	ephemeris		 :: ephemeris.Ephemeris of the site
+	startTime		 :: GPS time at which the schedule starts
+	duration		 :: Duration in seconds, counted as in observationSchedule
+	integrationTime	 :: Time spent per tile in seconds
+	CI				 :: Only tiles more probable than the last tile needed to
+						reach this probability are scheduled
+	'''
+	threshold = thresholdProbability(tileProbs, CI)
+	ntiles = int(np.sum(tileProbs > threshold)) ### A prefix, the tiles are sorted
+	ra = np.asarray(ra)[:ntiles]
+	dec = np.asarray(dec)[:ntiles]
+	lat = location.lat.deg
+	lon = location.lon.deg
+
+	maxSteps = int(duration//integrationTime) + 1
+	nslots = int(np.ceil(DAY/integrationTime))
+	scheduled = np.zeros(ntiles, dtype=bool)
+	times = []
+	positions = []
+	steps = 0
+	k0 = 0
+	prevDark = False
+	while steps < maxSteps and len(positions) < ntiles:
+		slots, dark, cost = daySlots(startTime, k0, nslots, integrationTime,
+									 ephemeris, sunAltLimit, prevDark)
+		if not dark.any() and not prevDark:
+			raise ValueError('The sun does not set within 24 hours')
+		stepsBefore = steps + np.cumsum(cost) - cost
+		darkSlots = np.nonzero(dark & (stepsBefore < maxSteps))[0]
+		darkTimes = slots[darkSlots]
+
+		[index, rise, setting] = altAzEngine.visibleIntervals(slots[0],
+											slots[-1] + integrationTime,
+											ra, dec, lat, lon, tileAltLimit)
+		order = np.argsort(rise, kind='mergesort')
+		index, rise, setting = index[order], rise[order], setting[order]
+
+		heap = [] ### (rank, set time): the smallest rank is the most probable
+		p = 0
+		j = 0
+		while j < len(darkSlots):
+			t = darkTimes[j]
+			while p < len(rise) and rise[p] <= t:
+				heapq.heappush(heap, (index[p], setting[p]))
+				p += 1
+			while heap and (scheduled[heap[0][0]] or heap[0][1] <= t):
+				heapq.heappop(heap)
+			if heap:
+				rank = heapq.heappop(heap)[0]
+				scheduled[rank] = True
+				times.append(t)
+				positions.append(rank)
+				j += 1
+			elif p < len(rise):
+				### Nothing is up: jump to the first dark slot after the next rise
+				j = max(j + 1, np.searchsorted(darkTimes, rise[p]))
+			else:
+				break
+
+		steps += int(np.sum(cost))
+		prevDark = bool(dark[-1])
+		k0 += nslots
+
+	positions = np.array(positions, dtype='int64')
+	return makeSchedule(np.array(times), np.asarray(tileIndices)[positions],
+						np.asarray(tileProbs)[positions], ephemeris)
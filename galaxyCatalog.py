@@ -0,0 +1,167 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Galaxy catalogs stored as memory-mapped structured numpy arrays (.npy) with
+the columns ID, distance, dec and ra (see catalogDtype). The 7 column pickles
+made by createCatalog.py are converted once:
+
+python galaxyCatalog.py catalog.pkl
+
+which writes catalog.pkl.npy. If the catalog directory is not writable the
+pickle is converted in memory instead. Opening a catalog memory-maps the
+array, and
+the ranking methods of RankedTileGenerator go through it in chunks, so that
+catalogs with tens of millions of galaxies are never loaded into memory.
+The pixel of every galaxy is computed from its position at the resolution
+needed, and the best k galaxies are selected with a partial sort.
+
+"""
+
+import os
+import argparse
+import numpy as np
+import healpy as hp
+
+import tileIndex
+
+
+catalogDtype = [('ID', 'i8'), ('distance', 'f8'), ('dec', 'f8'), ('ra', 'f8')]
+
+
+def catalogFile(catalog):
+	'''
+	Returns the name of the .npy version of a catalog file.
+	'''
+	if catalog.endswith('.npy'):
+		return catalog
+	return catalog + '.npy'
+
+
+def fillCatalog(data, catalogData):
+	'''
+	Copies the columns of a 7 column catalog array into a structured array.
+	'''
+	data['ID'] = catalogData[:,0]
+	data['distance'] = catalogData[:,1]
+	data['dec'] = catalogData[:,2]
+	data['ra'] = catalogData[:,3]
+	return data
+
+
+def convertCatalog(catalog, output=None):
+	'''
+	METHOD		:: Converts a 7 column catalog pickle (ID, distance, dec, ra,
+				   closest pixel, pixel dec, pixel ra) to the structured .npy
+				   format. Returns the name of the written file.
+	'''
+	if output is None:
+		output = catalogFile(catalog)
+	catalogData = tileIndex.loadPickle(catalog)
+	data = np.lib.format.open_memmap(output, mode='w+', dtype=catalogDtype,
+									 shape=(len(catalogData),))
+	fillCatalog(data, catalogData)
+	data.flush()
+	return output
+
+
+def loadCatalog(catalog, mmap_mode='r'):
+	'''
+	METHOD		:: Returns the catalog as a (memory-mapped) structured array.
+				   Pickles are converted on first use, and again whenever the
+				   pickle is newer than its .npy version. If the .npy file
+				   cannot be written, the pickle is converted in memory.
+	'''
+	filename = catalogFile(catalog)
+	if filename != catalog and (not os.path.exists(filename) or
+								os.path.getmtime(filename) < os.path.getmtime(catalog)):
+		try:
+			convertCatalog(catalog, filename)
+		except (IOError, OSError):
+			if os.path.exists(filename):
+				try: os.remove(filename) ### A partially written file
+				except OSError: pass
+			catalogData = tileIndex.loadPickle(catalog)
+			return fillCatalog(np.empty(len(catalogData), dtype=catalogDtype), catalogData)
+	return np.load(filename, mmap_mode=mmap_mode)
+
+
+def chunks(n, chunkSize):
+	'''
+	Yields slices covering range(n) in steps of chunkSize.
+	'''
+	for start in range(0, n, chunkSize):
+		yield slice(start, min(start + chunkSize, n))
+
+
+def pixels(data, nside, nest=False):
+	'''
+	Returns the HEALPix pixels of the galaxies of a catalog (chunk).
+	'''
+	theta = 0.5*np.pi - np.deg2rad(data['dec'])
+	phi = np.deg2rad(data['ra'])
+	return hp.ang2pix(nside, theta, phi, nest=nest)
+
+
+def topK(scores, k):
+	'''
+	Returns the positions of the k largest scores in decreasing order.
+	'''
+	if k < len(scores):
+		best = np.argpartition(-scores, k)[:k]
+	else:
+		best = np.arange(len(scores))
+	return best[np.argsort(-scores[best], kind='mergesort')]
+
+
+def rankCatalog(data, score, k=None, chunkSize=2**20):
+	'''
+	METHOD		:: Ranks the galaxies of a catalog by a score computed chunk by
+				   chunk. Returns the IDs and scores of the galaxies with a
+				   positive score in decreasing order, or of the best k only.
+				   With k given, only k candidates are kept between chunks.
+
+	data		:: The catalog (see loadCatalog)
+	score		:: Function returning the scores of a chunk of the catalog
+	k			:: (Optional) number of galaxies to return
+	'''
+	rows = []
+	scores = []
+	for sel in chunks(len(data), chunkSize):
+		chunkScores = np.asarray(score(data[sel]), dtype='float64')
+		keep = np.nonzero(chunkScores > 0)[0]
+		rows.append(keep + sel.start)
+		scores.append(chunkScores[keep])
+		if k is not None and sum([len(r) for r in rows]) > 2*k:
+			rows = [np.concatenate(rows)]
+			scores = [np.concatenate(scores)]
+			best = topK(scores[0], k)
+			rows = [rows[0][best]]
+			scores = [scores[0][best]]
+	rows = np.concatenate(rows) if rows else np.zeros(0, dtype='int64')
+	scores = np.concatenate(scores) if scores else np.zeros(0)
+	best = topK(scores, len(scores) if k is None else k)
+	return [np.asarray(data['ID'][rows[best]]), scores[best]]
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert galaxy catalog pickles '
+												 'to the memory-mapped format')
+	parser.add_argument('catalogs', nargs='+', help='catalog pickle files')
+	args = parser.parse_args()
+	for catalog in args.catalogs:
+		print(convertCatalog(catalog))
@@ -0,0 +1,134 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Limiting magnitude of a telescope as a function of integration time. The
+data (time, limiting magnitude and optionally its error) are fitted once
+with the same degree 5 smoothing splines in log(time) that optimize_time and
+detectability used to fit on every call:
+
+model = instrumentModel.getInstrumentModel('timeMagnitude_new.dat')
+model.limmag(time_per_tile)
+model.error(time_per_tile)
+
+Only the spline knots and coefficients are stored, so the object is small
+and cheap to pickle (e.g. to send to worker processes). tabulate() adds a
+dense lookup table in log(time) that is linearly interpolated instead of
+evaluating the spline, for models evaluated millions of times.
+
+"""
+
+import numpy as np
+from scipy import interpolate
+
+import sharedCache
+
+
+class InstrumentModel:
+	'''
+	time_data	:: Integration times in seconds
+	limmag_data	:: Limiting magnitudes at these times
+	error_data	:: (Optional) errors (sigma) of the limiting magnitudes
+	k			:: Degree of the splines
+	'''
+	def __init__(self, time_data, limmag_data, error_data=None, k=5):
+		logTime = np.log(np.asarray(time_data, dtype='float64'))
+		### Same smoothing as interpolate.UnivariateSpline with unit weights
+		self.limmagSpline = interpolate.splrep(logTime, limmag_data, k=k, s=len(logTime))
+		self.errorSpline = None
+		if error_data is not None:
+			self.errorSpline = interpolate.splrep(logTime, error_data, k=k,
+												  s=len(logTime))
+		self.table = None
+
+	@classmethod
+	def fromFile(cls, filename, k=5):
+		'''
+		METHOD		:: Reads the model from a text file with the columns time,
+					   limiting magnitude and (optionally) error.
+		'''
+		data = np.loadtxt(filename, unpack=True)
+		return cls(data[0], data[1], data[2] if len(data) > 2 else None, k=k)
+
+	@property
+	def hasError(self):
+		return self.errorSpline is not None
+
+	@property
+	def nbytes(self):
+		size = sum([arr.nbytes for arr in self.limmagSpline[:2]])
+		if self.table is not None:
+			size += sum([arr.nbytes for arr in self.table if arr is not None])
+		return size
+
+	def tabulate(self, tmin=1.0, tmax=1e5, n=10000):
+		'''
+		METHOD	:: Precomputes the splines on n points uniform in log(time)
+				   between tmin and tmax. Later evaluations inside this range
+				   interpolate the table linearly.
+		'''
+		logTime = np.linspace(np.log(tmin), np.log(tmax), n)
+		errors = None
+		if self.hasError:
+			errors = interpolate.splev(logTime, self.errorSpline)
+		self.table = (logTime, interpolate.splev(logTime, self.limmagSpline), errors)
+		return self
+
+	def _lookup(self, logTime, column):
+		### The grid is uniform, so the cell is found without a search
+		grid = self.table[0]
+		values = self.table[column]
+		pos = (logTime - grid[0])*((len(grid) - 1)/(grid[-1] - grid[0]))
+		cell = np.clip(pos.astype('int64'), 0, len(grid) - 2)
+		frac = pos - cell
+		return values[cell]*(1.0 - frac) + values[cell + 1]*frac
+
+	def _evaluate(self, t, spline, column):
+		logTime = np.log(np.asarray(t, dtype='float64'))
+		if self.table is None:
+			return interpolate.splev(logTime, spline)
+		grid = self.table[0]
+		inside = (logTime >= grid[0]) & (logTime <= grid[-1])
+		if np.all(inside):
+			return self._lookup(logTime, column)
+		values = np.atleast_1d(interpolate.splev(logTime, spline))
+		inside = np.atleast_1d(inside)
+		values[inside] = self._lookup(np.atleast_1d(logTime)[inside], column)
+		return values.reshape(logTime.shape)
+
+	def limmag(self, t):
+		'''
+		Returns the limiting magnitude for integration times t (seconds).
+		'''
+		return self._evaluate(t, self.limmagSpline, 1)
+
+	def error(self, t):
+		'''
+		Returns the error of the limiting magnitude for integration times t.
+		'''
+		if not self.hasError:
+			raise ValueError('The instrument model has no error data')
+		return self._evaluate(t, self.errorSpline, 2)
+
+
+def getInstrumentModel(filename):
+	'''
+	Returns the InstrumentModel of a data file from the process-wide cache,
+	fitted once per file.
+	'''
+	return sharedCache.getCache().getOrCompute(('instrument', sharedCache.fileKey(filename)),
+											   InstrumentModel.fromFile, filename)
@@ -0,0 +1,203 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Per-stage instrumentation of RankedTileGenerator, Scheduler and the modules
+they use (sky-map reading and regridding, tile index loading, tile sums,
+ranking, alt/az transforms, ephemeris tables, scheduling). Every stage that
+runs while at least one hook is installed produces a record
+
+{'stage': 'tile_sums', 'start': <unix time>, 'seconds': 0.012, 'calls': 3,
+ 'depth': 1, 'peak_bytes': 1048576}
+
+where calls counts the calls of the stage so far and depth is the nesting
+level. Hooks are callables receiving the record; jsonLinesHook() writes the
+records as JSON lines:
+
+instrumentation.addHook(instrumentation.jsonLinesHook('stages.jsonl'))
+instrumentation.traceMemory(True)	### optional, Python 3.9+ only and slower
+
+peak_bytes is None unless memory tracing is on. Per-stage peaks need
+tracemalloc.reset_peak (Python 3.9); on older versions traceMemory() returns
+False and no peak is recorded rather than a wrong one. Without hooks, an
+instrumented call costs one extra function call and a test.
+
+"""
+
+import sys
+import json
+import time
+import threading
+from functools import wraps
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None ### Python 2: no memory tracing
+if tracemalloc is not None and not hasattr(tracemalloc, 'reset_peak'):
+	tracemalloc = None ### Python < 3.9: the peaks of nested stages cannot be separated
+
+
+_hooks = []
+_calls = {}
+_seconds = {}
+_state = threading.local()
+
+
+def addHook(hook):
+	'''
+	Installs a callable that receives the record of every finished stage.
+	'''
+	_hooks.append(hook)
+	return hook
+
+
+def removeHook(hook):
+	if hook in _hooks:
+		_hooks.remove(hook)
+
+
+def clearHooks():
+	del _hooks[:]
+
+
+def enabled():
+	return len(_hooks) > 0
+
+
+def traceMemory(on=True):
+	'''
+	Starts (or stops) tracemalloc so that the records carry the peak memory
+	allocated during each stage. Returns False if it is not available
+	(before Python 3.9).
+	'''
+	if tracemalloc is None:
+		return False
+	if on and not tracemalloc.is_tracing():
+		tracemalloc.start()
+	elif not on and tracemalloc.is_tracing():
+		tracemalloc.stop()
+	return True
+
+
+def jsonLinesHook(output=None):
+	'''
+	Returns a hook writing every record as one JSON line to output (a file
+	name, an open file, or stderr by default).
+	'''
+	if output is None:
+		output = sys.stderr
+	elif not hasattr(output, 'write'):
+		output = open(output, 'a')
+	def hook(record):
+		output.write(json.dumps(record) + '\n')
+		output.flush()
+	return hook
+
+
+def summary():
+	'''
+	Returns the total number of calls and seconds per stage recorded so far.
+	'''
+	return dict([(name, {'calls': _calls[name], 'seconds': _seconds.get(name, 0.0)})
+				 for name in _calls])
+
+
+def reset():
+	_calls.clear()
+	_seconds.clear()
+
+
+def _tracing():
+	return tracemalloc is not None and tracemalloc.is_tracing()
+
+
+class _Stage:
+	'''
+	Context manager timing one stage. The peak memory of a stage includes
+	the peaks of the stages nested in it.
+	'''
+	def __init__(self, name):
+		self.name = name
+
+	def __enter__(self):
+		stack = getattr(_state, 'stack', None)
+		if stack is None:
+			stack = _state.stack = []
+		self.peak = None
+		if _tracing():
+			if stack and stack[-1].peak is not None:
+				stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+			self.base = tracemalloc.get_traced_memory()[0]
+			tracemalloc.reset_peak()
+			self.peak = self.base
+		stack.append(self)
+		self.start = time.time()
+		return self
+
+	def __exit__(self, *exc):
+		seconds = time.time() - self.start
+		stack = _state.stack
+		stack.pop()
+		peakBytes = None
+		if self.peak is not None and _tracing():
+			self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+			peakBytes = self.peak - self.base
+			if stack and stack[-1].peak is not None:
+				stack[-1].peak = max(stack[-1].peak, self.peak)
+		_calls[self.name] = _calls.get(self.name, 0) + 1
+		_seconds[self.name] = _seconds.get(self.name, 0.0) + seconds
+		record = {'stage': self.name, 'start': self.start, 'seconds': seconds,
+				  'calls': _calls[self.name], 'depth': len(stack),
+				  'peak_bytes': peakBytes}
+		for hook in list(_hooks):
+			hook(record)
+		return False
+
+
+class _NoStage:
+	def __enter__(self):
+		return self
+
+	def __exit__(self, *exc):
+		return False
+
+_noStage = _NoStage()
+
+
+def stage(name):
+	'''
+	Returns a context manager recording the enclosed block as stage name,
+	or a shared no-op one if no hook is installed.
+	'''
+	if not _hooks:
+		return _noStage
+	return _Stage(name)
+
+
+def instrumented(name):
+	'''
+	Decorator recording every call of a function or method as stage name.
+	'''
+	def decorator(func):
+		@wraps(func)
+		def wrapper(*args, **kwargs):
+			if not _hooks:
+				return func(*args, **kwargs)
+			with _Stage(name):
+				return func(*args, **kwargs)
+		return wrapper
+	return decorator
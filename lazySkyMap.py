@@ -0,0 +1,239 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Lazy access to flat HEALPix sky-maps. Opening a map only reads its FITS
+header. The probability column is memory-mapped when it is first needed and
+regridded to any resolution in chunks of output pixels, summing (or
+splitting) the probability of the NESTED children of every pixel as
+hp.ud_grade(power=-2) does, so an nside 2048 map is never held in memory
+to rank tiles at a lower resolution. The output is in RING ordering and
+can be stored as float32 to halve its size:
+
+skymap = lazySkyMap.LazySkyMap('bayestar.fits', dtype='float32')
+pVal = skymap.regrid(512)
+
+pyramid() builds the maps at all resolutions from nside 64 up to a given
+one in a single pass over the file.
+values() reads any column (e.g. the distance layers of a 3-D sky-map) at a
+set of pixels only, such as the pixels of the galaxies of a catalog.
+
+Compressed (.gz) files cannot be memory-mapped; astropy decompresses them
+when the column is first read. The file is closed (and a decompressed column
+dropped) after every regrid(), values() or pyramid(), so nothing but the
+header stays in memory between calls. Maps with explicit pixel indices
+(partial sky) are read with hp.read_map, in regrid() and pyramid() alike.
+
+"""
+
+import numpy as np
+import healpy as hp
+from astropy.io import fits
+
+import sharedCache
+import instrumentation
+
+
+class LazySkyMap:
+	'''
+	filename	:: The sky-map (fits) file
+	dtype		:: dtype of the regridded maps ('float64' or 'float32')
+	chunkSize	:: Number of input pixels read at once
+	'''
+	def __init__(self, filename, dtype='float64', chunkSize=2**20):
+		self.filename = filename
+		self.dtype = np.dtype(dtype)
+		self.chunkSize = chunkSize
+		header = fits.getheader(filename, 1)
+		self.explicit = header.get('INDXSCHM', 'IMPLICIT').strip().upper() == 'EXPLICIT'
+		self.nest = header.get('ORDERING', 'RING').strip().upper() == 'NESTED'
+		self._data = None
+		self._hdus = None
+		if 'NSIDE' in header:
+			self.nside = int(header['NSIDE'])
+		else:
+			data, rowLength = self._column()
+			self.nside = hp.npix2nside(len(data)*rowLength)
+			self._release()
+
+	@property
+	def nbytes(self):
+		### Only a column read into memory (not memory-mapped) counts
+		if self._data is None:
+			return 0
+		return sharedCache.residentBytes(self._data)
+
+	def _column(self, field=0):
+		'''
+		Returns the (memory-mapped) column field (0 is the probability) and
+		its number of pixels per row.
+		'''
+		if self._hdus is None:
+			self._hdus = fits.open(self.filename, memmap=True)
+		if field:
+			data = self._hdus[1].data.field(field)
+		else:
+			if self._data is None:
+				self._data = self._hdus[1].data.field(0)
+			data = self._data
+		rowLength = 1 if data.ndim == 1 else data.shape[1]
+		return data, rowLength
+
+	def _readExplicit(self, field=0):
+		'''
+		Returns the full map (or the maps of a tuple of columns) of a file
+		with explicit pixel indices, with zeros in the pixels it leaves out.
+		'''
+		skymap = hp.read_map(self.filename, field=field, verbose=False)
+		skymap[skymap == hp.UNSEEN] = 0.0
+		return skymap
+
+	def _release(self):
+		'''
+		Closes the file and drops the column.
+		'''
+		self._data = None
+		if self._hdus is not None:
+			self._hdus.close()
+			self._hdus = None
+
+	def _take(self, pixels, nest=True, field=0):
+		'''
+		Returns the values of the native map (or of its column field) at
+		NESTED (or RING) pixel indices.
+		'''
+		data, rowLength = self._column(field)
+		if nest != self.nest:
+			pixels = hp.nest2ring(self.nside, pixels) if nest else hp.ring2nest(self.nside, pixels)
+		if rowLength == 1:
+			return data[pixels]
+		return data[pixels // rowLength, pixels % rowLength]
+
+	def values(self, pixels, fields=(0,), nest=False):
+		'''
+		METHOD	:: Returns a list with the values of every column in fields
+				   (0 is the probability, 1 to 3 the distance layers of a 3-D
+				   sky-map) at the given pixels of the native resolution.
+				   Only these pixels are read from the memory-mapped file.
+
+		pixels	:: Pixel indices at the native resolution
+		fields	:: Column numbers
+		nest	:: True if the pixel indices are in NESTED ordering
+		'''
+		if self.explicit:
+			if nest: pixels = hp.nest2ring(self.nside, pixels) ### read_map returns RING
+			layers = self._readExplicit(tuple(fields))
+			if len(fields) == 1: layers = [layers] ### read_map returns a single map
+			return [layer[pixels] for layer in layers]
+		try:
+			return [self._take(pixels, nest, field) for field in fields]
+		finally:
+			self._release()
+
+	@instrumentation.instrumented('skymap_regrid')
+	def regrid(self, nside):
+		'''
+		METHOD	:: Returns the map at resolution nside in RING ordering, with
+				   the probability of each pixel being the sum over its
+				   children (downgrading) or split equally between them
+				   (upgrading).
+		'''
+		if self.explicit:
+			return hp.ud_grade(self._readExplicit(), nside, power=-2).astype(self.dtype)
+		try:
+			return self._regrid(nside)
+		finally:
+			self._release()
+
+	def _regrid(self, nside):
+		npix = hp.nside2npix(nside)
+		result = np.empty(npix, dtype=self.dtype)
+		if nside <= self.nside:
+			factor = (self.nside//nside)**2 ### children per output pixel
+			children = np.arange(factor, dtype='int64')
+			step = max(self.chunkSize//factor, 1)
+		else:
+			factor = (nside//self.nside)**2 ### output pixels per input pixel
+			step = self.chunkSize
+		for start in range(0, npix, step):
+			ring = np.arange(start, min(start + step, npix))
+			if nside == self.nside:
+				result[start:start + len(ring)] = self._take(ring, nest=False)
+				continue
+			nest = hp.ring2nest(nside, ring)
+			if nside < self.nside:
+				values = self._take((nest[:,None]*factor + children[None,:]).ravel())
+				result[start:start + len(ring)] = np.sum(values.reshape(-1, factor)
+														 .astype('float64'), axis=1)
+			else:
+				result[start:start + len(ring)] = self._take(nest//factor)/float(factor)
+		return result
+
+	@instrumentation.instrumented('skymap_pyramid')
+	def pyramid(self, top, bottom=64):
+		'''
+		METHOD	:: Returns the maps at every resolution bottom, 2*bottom, ...,
+				   top (at most the native nside) as a list in RING ordering,
+				   built in one pass over the file: the native map is read in
+				   NESTED chunks aligned to the bottom level pixels, and every
+				   level is the sum over groups of 4 pixels of the level above.
+		'''
+		if self.explicit:
+			skymap = self._readExplicit()
+			nside = bottom
+			levels = []
+			while nside <= min(top, self.nside):
+				levels.append(hp.ud_grade(skymap, nside, power=-2).astype(self.dtype))
+				nside *= 2
+			return levels
+		try:
+			return self._pyramid(top, bottom)
+		finally:
+			self._release()
+
+	def _pyramid(self, top, bottom):
+		top = min(top, self.nside)
+		nsides = [bottom]
+		while nsides[-1] < top:
+			nsides.append(2*nsides[-1])
+		nested = [np.empty(hp.nside2npix(n), dtype=self.dtype) for n in nsides]
+		children = (self.nside//top)**2 ### native pixels per top level pixel
+		perBottom = (self.nside//bottom)**2 ### native pixels per bottom level pixel
+		step = max(self.chunkSize//perBottom, 1)
+		npix = hp.nside2npix(bottom)
+		for start in range(0, npix, step):
+			stop = min(start + step, npix)
+			values = self._take(np.arange(start*perBottom, stop*perBottom))
+			level = np.sum(values.reshape(-1, children).astype('float64'), axis=1)
+			for ii in range(len(nsides) - 1, -1, -1):
+				scale = 4**ii ### level ii pixels per bottom level pixel
+				nested[ii][start*scale:stop*scale] = level
+				if ii: level = np.sum(level.reshape(-1, 4), axis=1)
+		levels = []
+		for n, values in zip(nsides, nested):
+			ring = np.empty(len(values), dtype=self.dtype)
+			for start in range(0, len(values), self.chunkSize):
+				pixels = np.arange(start, min(start + self.chunkSize, len(values)))
+				ring[pixels] = values[hp.ring2nest(n, pixels)]
+			levels.append(ring)
+		return levels
+
+	def read(self):
+		'''
+		Returns the full map at its native resolution (RING ordering).
+		'''
+		return self.regrid(self.nside)
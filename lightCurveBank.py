@@ -0,0 +1,111 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+A bank of kilonova light-curve models. Every model file (columns time and
+magnitude, as read by evolve_abs_Mag) is fitted once with the degree 5
+smoothing spline used by evolve_abs_Mag and sampled on a dense uniform time
+grid. The samples of all models are stored in one (models x samples) array,
+so the absolute magnitude of arrays of times, peak offsets and model numbers
+is found in one vectorized lookup:
+
+bank = lightCurveBank.getLightCurveBank(['NSNS_MNmodel1_FRDM_r', 'NSNS_MNmodel2_FRDM_r'])
+mags = bank.absMag(times[:,None], offset=0.5, model=np.arange(len(bank))[None,:])
+
+Lookups outside the time range of a model return nan. exact=True evaluates
+the splines themselves, which extrapolate outside the range as
+evolve_abs_Mag always did.
+
+"""
+
+import numpy as np
+from scipy import interpolate
+
+import sharedCache
+import readTable
+
+
+class LightCurveBank:
+	'''
+	models		:: List of light-curve model files
+	nsamples	:: Number of samples per model on its uniform time grid
+	'''
+	def __init__(self, models, nsamples=4096):
+		self.names = list(models)
+		self.splines = []
+		self.tmin = np.empty(len(self.names))
+		self.tmax = np.empty(len(self.names))
+		self.table = np.empty((len(self.names), nsamples))
+		for ii, model in enumerate(self.names):
+			data = readTable.readTable(model)
+			s = interpolate.UnivariateSpline(data['time'], data['magnitude'], k=5)
+			self.splines.append(s)
+			self.tmin[ii] = np.min(data['time'])
+			self.tmax[ii] = np.max(data['time'])
+			self.table[ii] = s(np.linspace(self.tmin[ii], self.tmax[ii], nsamples))
+		self.step = (self.tmax - self.tmin)/(nsamples - 1)
+
+	def __len__(self):
+		return len(self.names)
+
+	@property
+	def nbytes(self):
+		return self.table.nbytes
+
+	def index(self, name):
+		'''
+		Returns the model number of the model file name.
+		'''
+		return self.names.index(name)
+
+	def absMag(self, dt, offset=0, model=0, exact=False):
+		'''
+		METHOD	:: Returns the absolute magnitude at the times dt since the
+				   merger. dt, offset and model are broadcast against each
+				   other.
+
+		dt		:: Time since merger
+		offset	:: The offset of the peak of the light curve from the merger
+		model	:: Model number(s), the position in the list of model files
+		exact	:: If True, evaluate the splines instead of the tables
+		'''
+		dt, offset, model = np.broadcast_arrays(np.asarray(dt, dtype='float64'),
+												np.asarray(offset, dtype='float64'),
+												np.asarray(model, dtype='int64'))
+		t = dt - offset
+		if exact:
+			mags = np.empty(t.shape)
+			for ii in np.unique(model):
+				sel = model == ii
+				mags[sel] = self.splines[ii](t[sel])
+		else:
+			pos = (t - self.tmin[model])/self.step[model]
+			nsamples = self.table.shape[1]
+			cell = np.clip(np.floor(pos), 0, nsamples - 2).astype('int64')
+			frac = pos - cell
+			mags = self.table[model, cell]*(1.0 - frac) + self.table[model, cell + 1]*frac
+			mags = np.where((pos >= 0) & (pos <= nsamples - 1), mags, np.nan)
+		return mags if mags.ndim else mags[()]
+
+
+def getLightCurveBank(models, nsamples=4096):
+	'''
+	Returns the LightCurveBank of a list of model files from the process-wide
+	cache, so the models are read and fitted once.
+	'''
+	key = ('lightcurves', tuple([sharedCache.fileKey(model) for model in models]), nsamples)
+	return sharedCache.getCache().getOrCompute(key, LightCurveBank, models, nsamples)
@@ -0,0 +1,194 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Multi-order (NUNIQ) sky-maps, as produced by BAYESTAR. The map is kept as
+its table of multi-order pixels, without rasterizing it to a fixed nside.
+
+Every multi-order pixel covers a contiguous range of NESTED pixel indices at
+the deepest HEALPix order (29). With the pixels sorted by that range, the
+cumulative probability up to any order 29 index is a binary search plus a
+linear interpolation inside one pixel. The probability of any pixel of any
+nside, or of any range of consecutive NESTED pixels, is then the difference
+of the cumulative probability at its two ends. Tile probabilities need only
+the ends of the runs of consecutive NESTED pixels of the tiles (see
+tileIndex.TileRuns), so the cost scales with the number of multi-order pixels
+and runs rather than with the resolution.
+
+"""
+
+import numpy as np
+import healpy as hp
+from astropy.io import fits
+from astropy.table import Table
+
+import instrumentation
+
+
+MAX_ORDER = 29
+
+
+def isMultiOrder(filename):
+	'''
+	Returns True if the first extension of the FITS file is a NUNIQ table.
+	'''
+	try:
+		header = fits.getheader(filename, 1)
+	except (IndexError, KeyError):
+		return False
+	return header.get('ORDERING', '').strip().upper() == 'NUNIQ'
+
+
+def uniq2nest(uniq):
+	'''
+	Returns the order and NESTED pixel index of NUNIQ pixel numbers
+	(uniq = 4 * 4**order + ipix).
+	'''
+	uniq = np.asarray(uniq, dtype='int64')
+	order = (np.floor(np.log2(uniq)/2.0) - 1).astype('int64')
+	### Correct the float rounding of log2 for large pixel numbers
+	order -= uniq < np.left_shift(1, 2*order + 2)
+	order += uniq >= np.left_shift(1, 2*order + 4)
+	ipix = uniq - np.left_shift(1, 2*order + 2)
+	return order, ipix
+
+
+class MultiOrderSkyMap:
+	'''
+	A multi-order sky-map. The pixels are stored sorted by their position
+	in the NESTED order 29 index range.
+
+	filename	:: A multi-order FITS file with UNIQ and PROBDENSITY columns
+				   (and optionally DISTMU, DISTSIGMA, DISTNORM)
+	'''
+	distanceColumns = ['DISTMU', 'DISTSIGMA', 'DISTNORM']
+
+	@instrumentation.instrumented('moc_read')
+	def __init__(self, filename):
+		table = Table.read(filename, format='fits')
+		order, ipix = uniq2nest(table['UNIQ'])
+		shift = 2*(MAX_ORDER - order)
+		start = np.left_shift(ipix, shift)
+		sort = np.argsort(start)
+		self.order = order[sort]
+		self.start = start[sort]
+		self.end = np.left_shift(ipix[sort] + 1, shift[sort])
+		self.area = np.pi/(3.0*4.0**self.order) ### steradians
+		self.probdensity = np.asarray(table['PROBDENSITY'], dtype='float64')[sort]
+		self.prob = self.probdensity*self.area
+		self.cumProb = np.append(0.0, np.cumsum(self.prob))
+		self.nside = 2**int(self.order.max())
+		self.distance = {}
+		for name in self.distanceColumns:
+			if name in table.colnames:
+				self.distance[name] = np.asarray(table[name], dtype='float64')[sort]
+
+	def __len__(self):
+		return len(self.prob)
+
+	@property
+	def nbytes(self):
+		### Including the searchedArea tables once they are built
+		return sum([value.nbytes for value in [self.order, self.start, self.end,
+					self.area, self.probdensity, self.prob, self.cumProb]]
+				   + [value.nbytes for value in self.distance.values()]
+				   + [value.nbytes for value in (getattr(self, '_searched', None) or [])])
+
+	def _cumulative(self, x):
+		'''
+		Cumulative probability of all order 29 NESTED indices below x.
+		'''
+		row = np.searchsorted(self.start, x, side='right') - 1
+		frac = (x - self.start[row]).astype('float64')/(self.end[row] - self.start[row])
+		return self.cumProb[row] + np.minimum(frac, 1.0)*self.prob[row]
+
+	def rows(self, ra, dec):
+		'''
+		Returns the rows of the multi-order pixels containing the positions
+		(degrees).
+		'''
+		theta = 0.5*np.pi - np.deg2rad(dec)
+		phi = np.deg2rad(ra)
+		x = hp.ang2pix(2**MAX_ORDER, theta, phi, nest=True)
+		return np.searchsorted(self.start, x, side='right') - 1
+
+	def pixelProbs(self, nside, pixels, nest=False):
+		'''
+		METHOD	:: Returns the probability contained in the given pixels of a
+				   HEALPix grid of resolution nside, integrating over all the
+				   multi-order pixels that overlap them.
+
+		nside	:: Resolution of the pixels
+		pixels	:: Pixel indices
+		nest	:: True if the pixel indices are in NESTED ordering
+		'''
+		pixels = np.asarray(pixels, dtype='int64')
+		if not nest: pixels = hp.ring2nest(nside, pixels)
+		return self.rangeProbs(nside, pixels, pixels + 1)
+
+	def rangeProbs(self, nside, starts, ends):
+		'''
+		METHOD	:: Returns the probability contained in the ranges of NESTED
+				   pixels starts[i] <= pixel < ends[i] of a HEALPix grid of
+				   resolution nside. A range costs as much as a single pixel,
+				   whatever its length.
+		'''
+		shift = 2*(MAX_ORDER - int(round(np.log2(nside))))
+		return (self._cumulative(np.left_shift(np.asarray(ends, dtype='int64'), shift))
+				- self._cumulative(np.left_shift(np.asarray(starts, dtype='int64'), shift)))
+
+	@instrumentation.instrumented('moc_rasterize')
+	def rasterize(self, nside):
+		'''
+		Returns the probability map in RING ordering at the given resolution.
+		Only needed for plotting; ranking never rasterizes the map.
+		'''
+		return self.pixelProbs(nside, np.arange(hp.nside2npix(nside)))
+
+	def credibleRegion(self, CI, nside):
+		'''
+		METHOD	:: Returns the pixels (RING ordering) at resolution nside that
+				   overlap the multi-order pixels of the smallest region
+				   containing the probability CI.
+		'''
+		order = np.argsort(-self.probdensity)
+		cumProb = np.cumsum(self.prob[order])
+		rows = order[:np.searchsorted(cumProb, CI) + 1]
+		shift = 2*(MAX_ORDER - int(round(np.log2(nside))))
+		first = np.right_shift(self.start[rows], shift)
+		### Multi-order pixels coarser than nside span several pixels
+		counts = np.maximum(np.right_shift(self.end[rows], shift) - first, 1)
+		within = np.arange(np.sum(counts)) - np.repeat(np.cumsum(counts) - counts, counts)
+		pixels = np.unique(np.repeat(first, counts) + within)
+		return hp.nest2ring(nside, pixels)
+
+	def searchedArea(self, ra, dec):
+		'''
+		METHOD	:: Returns the searched area (sq. deg) and searched probability
+				   to reach the source position(s), walking through the multi-
+				   order pixels in decreasing probability density.
+		'''
+		if getattr(self, '_searched', None) is None:
+			order = np.argsort(-self.probdensity)
+			rank = np.empty(len(order), dtype='int64')
+			rank[order] = np.arange(len(order))
+			cumProb = np.append(0.0, np.cumsum(self.prob[order]))
+			cumArea = np.append(0.0, np.cumsum(self.area[order]))*(180.0/np.pi)**2
+			self._searched = [rank, cumProb, cumArea]
+		[rank, cumProb, cumArea] = self._searched
+		index = rank[self.rows(ra, dec)]
+		return [cumArea[index], cumProb[index]]
@@ -0,0 +1,199 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Schedules several observatories at once over the same sky-map. Every site
+has its own tiling (tile center file and tile to pixel index) and its own
+integration time. Sample usage:
+
+sites = [{'site': 'Palomar', 'tileCoord': 'ZTF_tiles_set1_nowrap_indexed.dat'},
+		 {'site': 'lapalma', 'tileCoord': 'other_tiles.dat',
+		  'preCompFilePrefix': 'other_pixel_indices_', 'integrationTime': 300}]
+multiSite = multiSiteScheduler.MultiSiteScheduler('bayestar.fits.gz', sites)
+[timeline, coveredProb] = multiSite.schedule(eventTime, 2*86400)
+
+The dark time slots and the analytic tile visibility intervals of every site
+are computed concurrently in a process pool. The sites are then advanced
+together in time order: at each dark slot of a site the tile with the most
+probability not yet covered by any site is observed. The covered pixels are
+shared, so a tile observed by one site drops out of the queues of the others
+(and overlapping tiles of other tilings lose the overlapping probability).
+Priorities are refreshed lazily when a tile reaches the top of a queue.
+
+"""
+
+import heapq
+import multiprocessing
+import numpy as np
+from astropy import units as u
+from astropy.coordinates import EarthLocation
+
+import rankedTilesGenerator
+import ephemeris
+import altAzEngine
+import instrumentation
+import readTable
+
+
+timelineDtype = [('time', 'f8'), ('site', 'i8'), ('tile', 'i8'), ('prob', 'f8'),
+				 ('coveredProb', 'f8')]
+
+
+def _siteVisibility(args):
+	'''
+	Pool worker: returns the dark slot times of a site in the window and
+	the visibility intervals of its ranked tiles.
+	'''
+	(lon, lat, height, ra, dec, startTime, endTime, step, tileAltLimit,
+	 sunAltLimit, ephemerisDir) = args
+	location = EarthLocation.from_geodetic(lon*u.degree, lat*u.degree, height*u.m)
+	eph = ephemeris.getEphemeris(location, cacheDir=ephemerisDir)
+	slots = np.arange(startTime, endTime, step)
+	darkTimes = slots[eph.sunAlt(slots) < sunAltLimit]
+	[index, rise, setting] = altAzEngine.visibleIntervals(startTime, endTime, ra, dec,
+														  lat, lon, tileAltLimit)
+	order = np.argsort(rise, kind='mergesort')
+	return [darkTimes, index[order], rise[order], setting[order]]
+
+
+class MultiSiteScheduler:
+	'''
+	skymapFile	:: The sky-map (fits) file
+	sites		:: List of dictionaries, one per site, with the keys
+				   site				 :: astropy site name or EarthLocation
+										(required)
+				   tileCoord		 :: tile coordinate file (required)
+				   preCompFilePrefix :: prefix of the tile pixel index files
+				   integrationTime	 :: time per tile in seconds (default 120)
+	resolution	:: The nside at which coverage is shared between the sites.
+				   All tilings need an index at this resolution.
+	CI			:: Each site only schedules its tiles more probable than the
+				   last tile needed to reach this probability
+	'''
+	def __init__(self, skymapFile, sites, resolution=None, CI=0.99,
+				 tileAltLimit=20.0, sunAltLimit=-18.0, ephemerisDir=None):
+		self.sites = []
+		self.tileAltLimit = tileAltLimit
+		self.sunAltLimit = sunAltLimit
+		self.ephemerisDir = ephemerisDir
+		for config in sites:
+			prefix = config.get('preCompFilePrefix', 'preComputed_pixel_indices_')
+			tileObj = rankedTilesGenerator.RankedTileGenerator(skymapFile, prefix)
+			if resolution is None: resolution = tileObj._resolution()
+			self.resolution = tileObj._resolution(resolution)
+			[tileIndices, tileProbs, threshold] = tileObj.rankTiles(resolution=self.resolution,
+																   probability=CI)
+			ntiles = np.sum(tileProbs > threshold)
+			tileData = readTable.readTable(config['tileCoord'])
+			tileIndices = tileIndices[:ntiles]
+			site = config['site']
+			if isinstance(site, EarthLocation):
+				location = site
+			else:
+				location = EarthLocation.of_site(site)
+			self.sites.append({'name': site,
+							   'location': location,
+							   'integrationTime': config.get('integrationTime', 120),
+							   'tileIndices': tileIndices,
+							   'tileProbs': tileProbs[:ntiles],
+							   'ra': tileData['ra_center'][tileIndices],
+							   'dec': tileData['dec_center'][tileIndices],
+							   'index': tileObj._tileIndexAt(self.resolution)})
+		self.pVal = tileObj._skymapAt(self.resolution)
+
+	@instrumentation.instrumented('multisite_visibility')
+	def _visibility(self, startTime, endTime, nproc):
+		jobs = []
+		for site in self.sites:
+			lon, lat, height = site['location'].to_geodetic()[:3]
+			jobs.append((lon.deg, lat.deg, height.to(u.m).value, site['ra'], site['dec'],
+						 startTime, endTime, site['integrationTime'],
+						 self.tileAltLimit, self.sunAltLimit, self.ephemerisDir))
+		if nproc == 1 or len(jobs) == 1:
+			return [_siteVisibility(job) for job in jobs]
+		pool = multiprocessing.Pool(nproc or len(jobs))
+		try:
+			return pool.map(_siteVisibility, jobs)
+		finally:
+			pool.close()
+			pool.join()
+
+	@instrumentation.instrumented('multisite_schedule')
+	def schedule(self, startTime, duration, nproc=None):
+		'''
+		METHOD		:: Plans all sites between startTime and startTime + duration
+					   (GPS seconds; here duration is wall-clock time). Returns
+					   the merged timeline, a structured array with the fields
+					   time, site (position in the sites list), tile, prob (the
+					   new probability covered by the observation) and
+					   coveredProb (cumulative), and the total probability
+					   covered.
+
+		nproc		:: Processes used for the per-site visibility computation.
+		'''
+		visibility = self._visibility(startTime, startTime + duration, nproc)
+		covered = np.zeros(len(self.pVal), dtype=bool)
+		state = []
+		clock = [] ### (next slot time, site number)
+		for ii, (darkTimes, index, rise, setting) in enumerate(visibility):
+			state.append({'darkTimes': darkTimes, 'slot': 0, 'index': index,
+						  'rise': rise, 'setting': setting, 'p': 0, 'heap': [],
+						  'observed': np.zeros(len(self.sites[ii]['tileIndices']),
+											   dtype=bool)})
+			if len(darkTimes): heapq.heappush(clock, (darkTimes[0], ii))
+
+		timeline = []
+		totalProb = 0.0
+		while clock:
+			t, ii = heapq.heappop(clock)
+			site, st = self.sites[ii], state[ii]
+			while st['p'] < len(st['rise']) and st['rise'][st['p']] <= t:
+				pos = st['index'][st['p']]
+				heapq.heappush(st['heap'], (-site['tileProbs'][pos], pos, st['setting'][st['p']]))
+				st['p'] += 1
+
+			chosen = None
+			while st['heap']:
+				negProb, pos, setTime = heapq.heappop(st['heap'])
+				if setTime <= t or st['observed'][pos]: continue
+				pixels = site['index'][site['tileIndices'][pos]]
+				remaining = np.sum(self.pVal[pixels][~covered[pixels]])
+				if remaining <= 0: continue
+				if remaining < -negProb*(1 - 1e-9):
+					### Part of the tile was covered since it was queued
+					heapq.heappush(st['heap'], (-remaining, pos, setTime))
+					continue
+				chosen = (pos, pixels, remaining)
+				break
+
+			if chosen is not None:
+				pos, pixels, remaining = chosen
+				st['observed'][pos] = True
+				covered[pixels] = True
+				totalProb += remaining
+				timeline.append((t, ii, site['tileIndices'][pos], remaining, totalProb))
+				st['slot'] += 1
+			elif st['p'] < len(st['rise']):
+				### Nothing is up: jump to the first dark slot after the next rise
+				st['slot'] = max(st['slot'] + 1, np.searchsorted(st['darkTimes'],
+															st['rise'][st['p']]))
+			else:
+				continue ### Nothing left for this site
+			if st['slot'] < len(st['darkTimes']):
+				heapq.heappush(clock, (st['darkTimes'][st['slot']], ii))
+
+		return [np.array(timeline, dtype=timelineDtype), totalProb]
@@ -25,49 +25,210 @@ tileObj = rankedTilesGenerator.RankedTileGenerator('bayestar.fits.gz')
 This gives the ranked tile indices and their probabilities for the bayestar sky-map.
 The resolution is 512, thus ud_grading to this value from the actual sky-map resolution.
 The code expects the file ZTF_tiles_set1_nowrap_indexed.dat and the pickled file 
-preComputed_pixel_indices_512.dat to be in the same path. 
+preComputed_pixel_indices_512.dat to be in the same path. If the memory-mapped
+version of the index (preComputed_pixel_indices_512.pixels.npy and
+preComputed_pixel_indices_512.offsets.npy, see tileIndex.py) is present it is
+used instead of the pickle.
+
+Multi-order (NUNIQ) BAYESTAR sky-maps are accepted as well. Tile probabilities,
+searched areas and galaxy probabilities are then computed on the multi-order
+pixels directly, without rasterizing the map (see multiOrder.py).
+
+The time, call count and peak memory of every stage (sky-map regridding, tile
+index loading, tile sums, ranking, alt/az transforms, scheduling, ...) can be
+recorded by installing a hook, see instrumentation.py. Progress messages are
+printed with verbose=True and otherwise logged at DEBUG level to the logger
+'rankedTilesGenerator' (as is every time step of observationSchedule).
 
 """
 
 import numpy as np
 import pylab as pl
-import pickle
 import sys
+import logging
 from math import ceil
 import healpy as hp
-from scipy import interpolate
+from scipy import special
+from scipy import optimize
+
+import tileIndex
+import sharedCache
+import tileLocator
+import multiOrder
+import visibility
+import ephemeris
+import altAzEngine
+import eventScheduler
+import instrumentModel
+import lightCurveBank
+import galaxyCatalog
+import lazySkyMap
+import instrumentation
+import readTable
 
 import time
 import datetime
 
 from astropy.time import Time
 from astropy import units as u
-from astropy.coordinates import get_sun
-from astropy.coordinates import get_moon
-from astropy.coordinates import get_body
 from astropy.coordinates import SkyCoord, EarthLocation, AltAz
 
 # from AllSkyMap_basic import AllSkyMap
 
+logger = logging.getLogger(__name__)
+
+
+def progress(verbose, message):
+	'''
+	Prints message if verbose, otherwise logs it at DEBUG level.
+	'''
+	if verbose: print(message)
+	else: logger.debug(message)
+
 
 
 class RankedTileGenerator:
-	def __init__(self, skymapfile):
-		self.skymap = hp.read_map(skymapfile, verbose=False)
-		npix = len(self.skymap)
-		self.nside = hp.npix2nside(npix)
-		self.preCompDictFiles = {64:'preComputed_pixel_indices_64.dat', 
-							128:'preComputed_pixel_indices_128.dat', 
-							256:'preComputed_pixel_indices_256.dat',
-							512:'preComputed_pixel_indices_512.dat',
-							1024:'preComputed_pixel_indices_1024.dat',
-							2048:'preComputed_pixel_indices_2048.dat'}
-				
+	def __init__(self, skymapfile, preCompFilePrefix='preComputed_pixel_indices_',
+				 dtype='float64'):
+		'''
+		skymapfile			:: The sky-map (fits) file
+		preCompFilePrefix	:: Prefix of the tile to pixel index files. The
+							   default is the ZTF index. Indices for other 
+							   telescopes can be built with tileFootprints.py.
+		dtype				:: dtype of the (regridded) sky-maps. 'float32'
+							   halves their memory.
+		'''
+		self.skymapfile = skymapfile
+		self.dtype = np.dtype(dtype)
+		self.moc = None
+		self.lazyMap = None
+		if multiOrder.isMultiOrder(skymapfile):
+			### Multi-order (NUNIQ) sky-maps are never rasterized for ranking
+			self.moc = sharedCache.getCache().getOrCompute(
+							('moc', sharedCache.fileKey(skymapfile)),
+							multiOrder.MultiOrderSkyMap, skymapfile)
+			self.nside = self.moc.nside
+		else:
+			### Only the header is read here, see lazySkyMap.py
+			self.lazyMap = sharedCache.getCache().getOrCompute(
+							('lazyskymap', sharedCache.fileKey(skymapfile), self.dtype.str),
+							lazySkyMap.LazySkyMap, skymapfile, self.dtype)
+			self.nside = self.lazyMap.nside
+		self.preCompDictFiles = {64:preCompFilePrefix + '64.dat', 
+							128:preCompFilePrefix + '128.dat', 
+							256:preCompFilePrefix + '256.dat',
+							512:preCompFilePrefix + '512.dat',
+							1024:preCompFilePrefix + '1024.dat',
+							2048:preCompFilePrefix + '2048.dat'}
+
+
+	def _resolution(self, resolution=None):
+		'''
+		Returns the nside to be used: the supplied resolution (or the sky-map
+		resolution if not supplied) rounded to a power of 2 between 64 and 2048.
+		'''
+		if not resolution:
+			resolution = self.nside
+		n = np.log(resolution)/np.log(2)
+		resolution = int(2 ** round(n)) ## resolution in powers of 2
+		if resolution > 2048: resolution = 2048
+		if resolution < 64: resolution = 64
+		return resolution
+
+
+	def _skymapAt(self, resolution):
+		'''
+		Returns the sky-map up/down graded to the given resolution. The result
+		is kept in the process-wide cache (see sharedCache.py) and must not be
+		modified in place. Resolutions from 64 to the native nside are levels
+		of the pyramid (see pyramid()).
+		'''
+		key = ('skymap', sharedCache.fileKey(self.skymapfile), resolution, self.dtype.str)
+		if self.moc is not None:
+			return sharedCache.getCache().getOrCompute(key, self.moc.rasterize,
+													   resolution)
+		level = int(round(np.log2(resolution/64.)))
+		if 64 <= resolution <= self.nside and 64*2**level == resolution:
+			return self.pyramid(resolution)[level]
+		return sharedCache.getCache().getOrCompute(key, self.lazyMap.regrid, resolution)
+
+
+	def pyramid(self, resolution=None):
+		'''
+		METHOD		:: Returns the sky-maps (RING ordering) at nside 64, 128, ...
+					   up to resolution (default and maximum: the native
+					   nside) as a list, all built in one pass over the file
+					   (see lazySkyMap.py). The levels are kept in the process-
+					   wide cache; asking for a finer level than those kept
+					   rebuilds them up to it. Not available for multi-order
+					   sky-maps.
+		'''
+		if self.moc is not None:
+			raise ValueError('Multi-order sky-maps have no pyramid')
+		if self.nside < 64:
+			raise ValueError('The sky-map resolution is below nside 64')
+		top = min(resolution or self.nside, self.nside)
+		key = ('pyramid', sharedCache.fileKey(self.skymapfile), self.dtype.str)
+		cache = sharedCache.getCache()
+		levels = cache.get(key)
+		if levels is None or 64*2**(len(levels) - 1) < top:
+			levels = cache.put(key, self.lazyMap.pyramid(top))
+		return levels
+
+
+	@property
+	def skymap(self):
+		'''
+		The sky-map at its native resolution, read on first use (None for
+		multi-order sky-maps).
+		'''
+		if self.moc is not None:
+			return None
+		return self._skymapAt(self.nside)
+
+
+	def _pixelProbs(self, resolution, pixels):
+		'''
+		Returns the probability in the given (RING) pixels at the given 
+		resolution. Multi-order sky-maps are evaluated only at these pixels.
+		'''
+		if self.moc is not None:
+			return self.moc.pixelProbs(resolution, pixels)
+		return self._skymapAt(resolution)[pixels]
+
+
+	def _tileIndexAt(self, resolution):
+		'''
+		Returns the tile to pixel index for the given resolution from the 
+		process-wide cache, loading it on first use.
+		'''
+		return tileIndex.cachedTileIndex(self.preCompDictFiles[resolution], resolution)
+
+
+	def _inverseIndexAt(self, resolution):
+		'''
+		Returns the pixel to tile index for the given resolution from the
+		process-wide cache.
+		'''
+		return tileIndex.cachedInverse(self.preCompDictFiles[resolution], resolution)
+
 
-	def sourceTile(self, ra, dec, tiles):
+	def _tileRunsAt(self, resolution):
+		'''
+		Returns the tiles as runs of NESTED pixels for the given resolution
+		from the process-wide cache (used with multi-order sky-maps).
+		'''
+		return tileIndex.cachedRuns(self.preCompDictFiles[resolution], resolution)
+
+
+	@instrumentation.instrumented('sourceTile')
+	def sourceTile(self, ra, dec, tiles, resolution=None, allTiles=False):
 		'''
 		METHOD     :: This method takes the position of the injected 
-					  event and returns the tile index
+					  event and returns the tile index. Arrays of positions
+					  return arrays of tile indices. The tile centers are 
+					  kept in a KD-tree built once per tiling file (see
+					  tileLocator.py).
 					  
 		ra		   :: Right ascension of the source in degrees
 		dec		   :: Declination angle of the source in degrees
@@ -76,21 +237,21 @@ class RankedTileGenerator:
 						1  24.714290	-85.938460
 						2  76.142860	-85.938460
 						...
+		resolution :: (optional) Resolution of the tile pixel index used 
+					  with allTiles.
+		allTiles   :: If True, return every tile whose footprint contains
+					  the position instead of the closest tile center, as
+					  two arrays [position number, tile index].
 		'''
-		tileData = np.recfromtxt(tiles, names=True)
-		Dec_tile = tileData['dec_center']
-		RA_tile = tileData['ra_center']
-		ID = tileData['ID']
-		s = np.arccos( np.sin(np.pi*dec/180.)\
-			* np.sin(np.pi*Dec_tile/180.)\
-			+ np.cos(np.pi*dec/180.)\
-			* np.cos(np.pi*Dec_tile/180.) \
-			* np.cos(np.pi*(RA_tile - ra)/180.) )
-		index = np.argmin(s) ### minimum angular distance index
-
-		return ID[index] - 1 ### Since the indexing begins with 1.
+		locator = tileLocator.getTileLocator(tiles)
+		if allTiles:
+			resolution = self._resolution(resolution)
+			return locator.containing(ra, dec, self._inverseIndexAt(resolution),
+									  resolution)
+		return locator.nearest(ra, dec)
 
 	
+	@instrumentation.instrumented('searchedArea')
 	def searchedArea(self, ra, dec, resolution=None):
 		'''
 		METHOD     :: This method takes the position of the injected 
@@ -105,19 +266,13 @@ class RankedTileGenerator:
 		ra		   :: Right ascension of the source in degrees
 		dec		   :: Declination angle of the source in degrees
 		resolution :: The value of the nside, if not supplied, 
-					  the default skymap is used.
+					  the default skymap is used. Multi-order sky-maps
+					  are searched on their own pixels and ignore it.
 		'''
-		if not resolution:
-			resolution = self.nside
-		n = np.log(resolution)/np.log(2)
-		resolution = int(2 ** round(n)) ## resolution in powers of 2
-		if resolution > 2048: resolution = 2048
-		if resolution < 64: resolution = 64
-		filename = self.preCompDictFiles[resolution]
-		File = open(filename, 'rb')
-		data = pickle.load(File)
-		tile_index = np.arange(len(data))
-		skymapUD = hp.ud_grade(self.skymap, resolution, power=-2)
+		if self.moc is not None:
+			return self.moc.searchedArea(ra, dec)
+		resolution = self._resolution(resolution)
+		skymapUD = self._skymapAt(resolution)
 		npix = len(skymapUD)
 		theta, phi = hp.pix2ang(resolution, np.arange(0, npix))
 		ra_map = np.rad2deg(phi) # Construct ra array
@@ -137,8 +292,109 @@ class RankedTileGenerator:
 		searchedArea = index*hp.nside2pixarea(resolution, degrees=True)
 		return [searchedArea, coveredProb]
 
+
+	def _searchedRanks(self, resolution):
+		'''
+		Returns the rank of every pixel in the descending probability order
+		and the cumulative probability of the sorted pixels (starting at 0).
+		'''
+		skymapUD = self._skymapAt(resolution)
+		order = np.argsort(-skymapUD)
+		rank = np.empty(len(order), dtype='int32')
+		rank[order] = np.arange(len(order))
+		cumProb = np.append(0.0, np.cumsum(skymapUD[order]))
+		return [rank, cumProb]
+
+
+	def _sortedPixels(self, resolution):
+		'''
+		Cached version of _searchedRanks.
+		'''
+		key = ('searched', sharedCache.fileKey(self.skymapfile), resolution)
+		return sharedCache.getCache().getOrCompute(key, self._searchedRanks,
+												   resolution)
+
+
+	def _credibleRegion(self, resolution, CI):
+		'''
+		Returns the (RING) pixels at the given resolution in the smallest 
+		region that contains the probability CI. Only the pixels above a
+		threshold are selected and sorted; the threshold is lowered until
+		they hold the probability CI, so the cost of the sort scales with
+		the localization area.
+		'''
+		if self.moc is not None:
+			return self.moc.credibleRegion(CI, resolution)
+		skymapUD = self._skymapAt(resolution)
+		threshold = skymapUD.max()
+		for ii in range(8):
+			threshold *= 1e-2
+			candidates = np.nonzero(skymapUD >= threshold)[0]
+			if np.sum(skymapUD[candidates]) >= CI: break
+		else:
+			candidates = np.arange(len(skymapUD))
+		region = candidates[topTiles(skymapUD[candidates], probability=CI)]
+		return np.sort(region)
+
+
+	@instrumentation.instrumented('searchedAreaBatch')
+	def searchedAreaBatch(self, ra, dec, resolution=None):
+		'''
+		METHOD     :: Vectorized version of searchedArea for arrays of source
+					  positions (e.g. many injections or posterior samples).
+					  The sorting of the sky-map is done once per resolution
+					  and cached, after which every position is a single 
+					  pixel lookup. The source pixel is the pixel containing
+					  the position rather than the one with the closest 
+					  center, which can differ for positions near pixel edges.
+					  Returns the arrays of searched area and searched 
+					  probability.
+					  
+		ra		   :: Array of right ascensions of the sources in degrees
+		dec		   :: Array of declinations of the sources in degrees
+		resolution :: The value of the nside, if not supplied, 
+					  the default skymap is used. Ignored for multi-order
+					  sky-maps, as in searchedArea.
+		'''
+		if self.moc is not None:
+			return self.moc.searchedArea(ra, dec)
+		resolution = self._resolution(resolution)
+		[rank, cumProb] = self._sortedPixels(resolution)
+		theta = 0.5*np.pi - np.deg2rad(dec)
+		phi = np.deg2rad(ra)
+		index = rank[hp.ang2pix(resolution, theta, phi)]
+		searchedArea = index*hp.nside2pixarea(resolution, degrees=True)
+		coveredProb = cumProb[index]
+		return [searchedArea, coveredProb]
+
 	
-	def ZTF_RT(self, resolution=None, verbose=False):
+	@instrumentation.instrumented('tile_sums')
+	def _tileProbs(self, resolution, CI=None):
+		'''
+		Returns the tile indices and the (unsorted) tile probabilities at the
+		given resolution. With CI, only the tiles overlapping the CI credible
+		region (see ZTF_RT).
+		'''
+		data = self._tileIndexAt(resolution)
+		tile_index = np.arange(len(data))
+		if CI is not None:
+			pixels = self._credibleRegion(resolution, CI)
+			inverse = self._inverseIndexAt(resolution)
+			tile_index = np.unique(inverse.gather(pixels)[0])
+			tilePixels, owner = data.gather(tile_index)
+			allTiles_probs = np.bincount(owner, minlength=len(tile_index),
+								weights=self._pixelProbs(resolution, tilePixels))
+		elif self.moc is not None:
+			runs = self._tileRunsAt(resolution)
+			allTiles_probs = runs.sumEntries(self.moc.rangeProbs(resolution, runs.pixels,
+																 runs.ends))
+		else:
+			allTiles_probs = data.tileSums(self._skymapAt(resolution))
+		return [tile_index, allTiles_probs]
+
+
+	@instrumentation.instrumented('ZTF_RT')
+	def ZTF_RT(self, resolution=None, verbose=False, CI=None):
 		'''
 		METHOD		:: This method returns two numpy arrays, the first
 					   contains the tile indeces of ZTF and the second
@@ -148,30 +404,16 @@ class RankedTileGenerator:
 		
 		resolution  :: The value of the nside, if not supplied, 
 					   the default skymap is used.
+		CI			:: (optional) Sparse ranking. Only the tiles that overlap
+					   the CI credible region are ranked, found through the
+					   inverse (pixel to tile) index, so the cost scales with
+					   the localization area. The probabilities returned are
+					   the full probabilities of those tiles.
 		'''
-		if not resolution:
-			resolution = self.nside
-		n = np.log(resolution)/np.log(2)
-		resolution = int(2 ** round(n)) ## resolution in powers of 2
-		if resolution > 2048: resolution = 2048
-		if resolution < 64: resolution = 64
-		if verbose: print 'Using resolution of ' + str(resolution)
-		filename = self.preCompDictFiles[resolution]
-		if verbose: print filename
-		File = open(filename, 'rb')
-		data = pickle.load(File)
-		tile_index = np.arange(len(data))
-		skymapUD = hp.ud_grade(self.skymap, resolution, power=-2)
-		npix = len(skymapUD)
-		theta, phi = hp.pix2ang(resolution, np.arange(0, npix))
-		pVal = skymapUD[np.arange(0, npix)]
-
-		allTiles_probs = []
-		for ii in range(0, len(data)):
-			pTile = np.sum(pVal[data[ii]])
-			allTiles_probs.append(pTile)
-
-		allTiles_probs = np.array(allTiles_probs)
+		resolution = self._resolution(resolution)
+		progress(verbose, 'Using resolution of ' + str(resolution))
+		progress(verbose, self.preCompDictFiles[resolution])
+		[tile_index, allTiles_probs] = self._tileProbs(resolution, CI)
 		index = np.argsort(-allTiles_probs)
 
 		allTiles_probs_sorted = allTiles_probs[index]
@@ -181,19 +423,40 @@ class RankedTileGenerator:
 		return [tile_index_sorted, allTiles_probs_sorted]
 
 
+	@instrumentation.instrumented('rankTiles')
+	def rankTiles(self, resolution=None, probability=None, ntiles=None, CI=None):
+		'''
+		METHOD		:: Returns only the most probable tiles, selected with a
+					   partial sort so the cost grows with the number of tiles
+					   returned: the ranked tile indices, their probabilities
+					   and the threshold probability (that of the last tile
+					   returned). Without probability and ntiles all tiles are
+					   ranked as in ZTF_RT.
+
+		probability	:: Return the tiles needed to reach this probability: as
+					   in observationSchedule, the tiles whose cumulative
+					   probability is below it plus the next one. The tiles
+					   more probable than the threshold are then the ones to
+					   schedule.
+		ntiles		:: Return (at most) the ntiles most probable tiles
+		CI			:: (optional) Sparse ranking, see ZTF_RT
+		'''
+		resolution = self._resolution(resolution)
+		[tile_index, allTiles_probs] = self._tileProbs(resolution, CI)
+		order = topTiles(allTiles_probs, probability, ntiles)
+		allTiles_probs_sorted = allTiles_probs[order]
+		threshold = allTiles_probs_sorted[-1] if len(order) else 0.0
+		return [tile_index[order], allTiles_probs_sorted, threshold]
+
+
 	def plot(self, tiles, ra, dec, resolution=None, CI=0.9):
-		tileData = np.recfromtxt(tiles, names=True)
+		tileData = readTable.readTable(tiles)
 		ra_center = tileData['ra_center']
 		dec_center = tileData['dec_center']
 
-		if not resolution:
-			resolution = self.nside
-		n = np.log(resolution)/np.log(2)
-		resolution = int(2 ** round(n)) ## resolution in powers of 2
-		if resolution > 2048: resolution = 2048
-		if resolution < 64: resolution = 64
-		print 'Using resolution of ' + str(resolution)
-		skymapUD = hp.ud_grade(self.skymap, resolution, power=-2)
+		resolution = self._resolution(resolution)
+		print('Using resolution of ' + str(resolution))
+		skymapUD = self._skymapAt(resolution)
 		hp.mollview(skymapUD)
 		hp.visufunc.projplot(dec_center, ra_center,  'c.', lonlat=True)
 		hp.visufunc.projplot(ra, dec,  'r*', markersize=10, lonlat=True)
@@ -201,12 +464,16 @@ class RankedTileGenerator:
 
 
 
-	def rankGalaxies2D(self, catalog, resolution=None):
+	@instrumentation.instrumented('rankGalaxies2D')
+	def rankGalaxies2D(self, catalog, resolution=None, k=None, chunkSize=2**20):
 		'''
 		METHOD  :: This method takes as input a galaxy catalog pickle file
 				   that is generated by running the createCatalog.py script.
 				   The output is the IDs of the galaxies from the catalog 
-				   ranked based on their localization probability.
+				   ranked based on their localization probability. Only
+				   galaxies with a non-zero probability are returned, so the
+				   output is shorter than the catalog when some galaxies lie
+				   outside the sky-map support.
 		
 		catalog	:: A pickle file which stores a 7 col numpy array with. The 
 				   columns of this array are defined below:
@@ -217,42 +484,78 @@ class RankedTileGenerator:
 				   		col5 : Closest BAYESTAR Healpix pixel to the galaxy
 				   		col6 : Declination angle of the closest pixel
 				   		col7 : Right ascencion of the closest pixel
+				   or its memory-mapped version (see galaxyCatalog.py), which
+				   is created from the pickle on first use.
 				   		
 		resolution :: Optional argument. allows you to fix the resolution of 
-					  the skymap. Currently the catalog file has only been 
-					  generated for resolution of 512. Use this value.
-				   
+					  the skymap. The pixel of every galaxy is computed at
+					  this resolution.
+		k		:: (Optional) only return the k most probable galaxies
+		chunkSize	:: Number of galaxies processed at once
 		'''
 
-		if not resolution:
-			resolution = self.nside
-		n = np.log(resolution)/np.log(2)
-		resolution = int(2 ** round(n)) ## resolution in powers of 2
-		if resolution > 2048: resolution = 2048
-		if resolution < 64: resolution = 64
-		filename = self.preCompDictFiles[resolution]
-		File = open(filename, 'rb')
-		data = pickle.load(File)
-		tile_index = np.arange(len(data))
-		skymapUD = hp.ud_grade(self.skymap, resolution, power=-2)
-		npix = len(skymapUD)
-		theta, phi = hp.pix2ang(resolution, np.arange(0, npix))
-		ra_map = np.rad2deg(phi) # Construct ra array
-		dec_map = np.rad2deg(0.5*np.pi - theta) # Construct dec array
-		pVal = skymapUD[np.arange(0, npix)]
-		
-		catalogFile = open(catalog, 'rb')
-		catalogData = pickle.load(catalogFile)
-		
-		indices = catalogData[:,4].astype('int') ### Indices of pixels for all galaxies
-		galaxy_probs = pVal[indices] ### Probability values of the galaxies in catalog
-		order = np.argsort(-galaxy_probs) ### Sorting in descending order of probability
-		galaxy_indices = catalogData[:,0].astype('int') ### Indices of galaxies
-		ranked_galaxies = galaxy_indices[order]
-		galaxy_probs = galaxy_probs[order]
+		resolution = self._resolution(resolution)
+		catalogData = galaxyCatalog.loadCatalog(catalog)
+		score = lambda data: self._pixelProbs(resolution,
+											  galaxyCatalog.pixels(data, resolution))
+		### Galaxies in pixels of zero probability are left out
+		[ranked_galaxies, galaxy_probs] = galaxyCatalog.rankCatalog(catalogData, score,
+																	k, chunkSize)
 		
 		return [ranked_galaxies, galaxy_probs]
 
+
+	def galaxyDensity(self, ra, dec, distance):
+		'''
+		METHOD	:: Returns the posterior probability per unit volume (per
+				   steradian per Mpc^3) at the given positions and distances
+				   (Mpc), using the distance layers of the sky-map:
+				   dP/dV = (prob/pixel area) * DISTNORM * N(distance; DISTMU,
+				   DISTSIGMA). Pixels without a valid distance estimate give 0.
+				   For flat sky-maps only the pixels of the positions are read
+				   from the memory-mapped file (see lazySkyMap.py).
+		'''
+		if self.moc is not None:
+			if len(self.moc.distance) < 3:
+				raise ValueError(self.skymapfile + ' has no distance layers')
+			rows = self.moc.rows(ra, dec)
+			probdensity = self.moc.probdensity[rows]
+			[mu, sigma, norm] = [self.moc.distance[name][rows] for name in
+								 multiOrder.MultiOrderSkyMap.distanceColumns]
+		else:
+			pixels = hp.ang2pix(self.nside, 0.5*np.pi - np.deg2rad(dec), np.deg2rad(ra))
+			try:
+				[prob, mu, sigma, norm] = self.lazyMap.values(pixels, fields=(0, 1, 2, 3))
+			except (IndexError, KeyError):
+				raise ValueError(self.skymapfile + ' has no distance layers')
+			probdensity = prob/hp.nside2pixarea(self.nside)
+		valid = np.isfinite(mu) & np.isfinite(norm) & (sigma > 0)
+		sigma = np.where(valid, sigma, 1.0)
+		density = (probdensity*norm*np.exp(-0.5*((distance - mu)/sigma)**2)
+				   /(np.sqrt(2*np.pi)*sigma))
+		return np.where(valid, density, 0.0)
+
+
+	@instrumentation.instrumented('rankGalaxies3D')
+	def rankGalaxies3D(self, catalog, k=None, chunkSize=2**20):
+		'''
+		METHOD	:: Ranks the galaxies of a catalog by the posterior probability
+				   per unit volume at their position and distance (see
+				   galaxyDensity). Needs a sky-map with distance layers (dense
+				   or multi-order). The catalog is streamed in chunks from its
+				   memory-mapped version and only the best k galaxies are kept
+				   if k is given. Returns the ranked galaxy IDs and their
+				   probability densities (galaxies of zero density are left
+				   out).
+
+		catalog	:: The catalog pickle or .npy file (see rankGalaxies2D)
+		k		:: (Optional) only return the k most probable galaxies
+		chunkSize	:: Number of galaxies processed at once
+		'''
+		catalogData = galaxyCatalog.loadCatalog(catalog)
+		score = lambda data: self.galaxyDensity(data['ra'], data['dec'], data['distance'])
+		return galaxyCatalog.rankCatalog(catalogData, score, k, chunkSize)
+
 	### Older version ###	
 
 # 	def integrationTime(self, T_obs, pValTiles=None):
@@ -293,46 +596,76 @@ class RankedTileGenerator:
 		pValTiles :: The probability value of the ranked tiles. Obtained from ZTF_RT 
 					 output
 		T_obs     :: Total observation time available for the follow-up.
-		func	  :: functional form of the weight. Default is linear. 
-					 For example, use x**2 to use a quadratic function.
+		func	  :: functional form of the weight. Default is linear. Either
+					 a function of the probabilities, e.g. lambda x: x**2 for
+					 a quadratic function, or (older usage) the string 'x**2'.
 		'''
 		if pValTiles is None:
 			pValTiles = self.allTiles_probs_sorted
 		
 		if func is None:
 			f = lambda x: x
+		elif callable(func):
+			f = func
 		else:
-			f = lambda x: eval(func)
-		fpValTiles = f(pValTiles)
-		modified_prob = fpValTiles/np.sum(fpValTiles)
-		t_tiles = modified_prob * T_obs ### Time spent in each tile if not constrained
-		t_tiles[t_tiles > 1200.0] = 1200.0 ### Upper limit of exposure time
-		t_tiles[t_tiles < 60] = 60.0 ### Lower limit of exposure time
-		Obs = np.cumsum(t_tiles) <= T_obs ### Tiles observable in T_obs seconds
+			f = eval('lambda x: ' + func)
+		[t_tiles, Obs] = allocateTime(f(pValTiles), T_obs)
 		time_per_tile = t_tiles[Obs] ### Actual time spent per tile
 		
 		return time_per_tile
 		
 
-	def optimize_time(self, T, M, range, pValTiles=None):
-		time_data, limmag_data, _ = np.loadtxt('timeMagnitude_new.dat', unpack=True)
-		s = interpolate.UnivariateSpline(np.log(time_data), limmag_data, k=5)
-		AA = np.linspace(range[0], range[1], 1000)
+	@instrumentation.instrumented('optimize_time')
+	def optimize_time(self, T, M, range, pValTiles=None, func=None, refine=False,
+					  nsteps=1000, model=None):
+		'''
+		METHOD	:: Finds the parameter a of the weight function that maximizes
+				   kappa = sum over the observed tiles of the tile probability
+				   times the distance out to which a source of absolute
+				   magnitude M is detected. All nsteps candidate values of a in
+				   range are evaluated at once as a 2-D array. Returns the time
+				   per tile of the best allocation, a and kappa.
+
+		T		:: Total observation time available for the follow-up
+		M		:: Absolute magnitude of the source
+		range	:: [min, max] of the weight parameter a
+		func	:: Weight function of the probabilities x and the parameter a,
+				   broadcast over both. Default is lambda x, a: x + a.
+		refine	:: If True, the best value of the scan is refined with a
+				   bounded scalar minimization between its neighbours.
+		model	:: instrumentModel.InstrumentModel giving the limiting
+				   magnitude against integration time. Default is the model
+				   of timeMagnitude_new.dat.
+		'''
 		if pValTiles is None:
 			pValTiles = self.allTiles_probs_sorted
-		kappa_sum = []		
-		for aa in AA:
-			time_per_tile = self.integrationTime(T, pValTiles, func='x + ' + str(aa))
-			limmag = s(np.log(time_per_tile))
-			dists = 10**(1.0 + (limmag - M)/5)
-			kappas = dists*pValTiles[:len(dists)]
-			kappa_sum.append(np.sum(kappas))
-		kappa_sum = np.array(kappa_sum)
+		pValTiles = np.asarray(pValTiles, dtype='float64')
+		if func is None:
+			func = lambda x, a: x + a
+		if model is None:
+			model = instrumentModel.getInstrumentModel('timeMagnitude_new.dat')
+
+		def kappa(AA):
+			[t_tiles, Obs] = allocateTime(func(pValTiles[None,:], AA[:,None]), T)
+			### Only the observed tiles contribute
+			[rows, cols] = np.nonzero(Obs)
+			dists = 10**(1.0 + (model.limmag(t_tiles[rows, cols]) - M)/5)
+			return np.bincount(rows, weights=dists*pValTiles[cols], minlength=len(AA))
+
+		AA = np.linspace(range[0], range[1], nsteps)
+		kappa_sum = kappa(AA)
 		maxIndex = np.argmax(kappa_sum)
 		a_max = AA[maxIndex]
 		kappa_max = kappa_sum[maxIndex]
-		time_per_tile_max = self.integrationTime(7200., pValTiles, func='x + ' + str(a_max))
-		return time_per_tile_max
+		if refine and nsteps > 1:
+			bounds = (AA[max(maxIndex - 1, 0)], AA[min(maxIndex + 1, nsteps - 1)])
+			res = optimize.minimize_scalar(lambda a: -kappa(np.array([a]))[0],
+										   bounds=bounds, method='bounded')
+			if -res.fun > kappa_max:
+				a_max = res.x
+				kappa_max = -res.fun
+		time_per_tile_max = self.integrationTime(T, pValTiles, func=lambda x: func(x, a_max))
+		return [time_per_tile_max, a_max, kappa_max]
 		
 ############ UNDER CONSTRUCTION ############
 	
@@ -341,21 +674,40 @@ class Scheduler(RankedTileGenerator):
 	The scheduler class: Inherits from the RankedTileGenerator class. If no attribute 
 	is supplied while creating schedular objects, a default instance of ZTF scheduler 
 	is created. To generate scheduler for other telescopes use the corresponding site
-	names which can be obtaine from astropy.coordinates.EarthLocation.get_site_names().
+	names which can be obtaine from astropy.coordinates.EarthLocation.get_site_names(),
+	or an EarthLocation.
 	The tile tile coordinate file also needs to be supplied to the variable tileCoord.
 	This file needs to have at least three columns, the first being an ID (1, 2, ...),
 	the second should be the tile center's ra value and the third the dec value of the 
 	same. The utcoffset is the time difference between UTC and the site in hours. 
+	The prefix of the matching tile to pixel index files is preCompFilePrefix.
+	Sun and moon positions are taken from interpolated ephemeris tables (see 
+	ephemeris.py); if ephemerisDir is given the tables are stored there and 
+	reused for later events on the same nights. The tile altitudes are computed
+	with the alt/az engine named by engine: 'astropy' (full AltAz transform) or
+	'numpy' (sidereal time plus rotation, ~0.01 deg accuracy; see altAzEngine.py).
+	Only the tiles needed to reach the probability CI are ranked and kept (CI=None
+	keeps all tiles); their threshold probability is thresholdTileProb. dtype is
+	passed to RankedTileGenerator.
 	'''
+	@instrumentation.instrumented('scheduler_init')
 	def __init__(self, skymapFile, site='Palomar', 
-				 tileCoord='ZTF_tiles_set1_nowrap_indexed.dat', utcoffset = -7.0):
+				 tileCoord='ZTF_tiles_set1_nowrap_indexed.dat', utcoffset = -7.0,
+				 preCompFilePrefix='preComputed_pixel_indices_', ephemerisDir=None,
+				 engine='astropy', CI=0.99, dtype='float64'):
 
-		self.Observatory = EarthLocation.of_site(site)
-		self.tileData = np.recfromtxt(tileCoord, names=True)
-		self.skymapfile = skymapFile
+		if isinstance(site, EarthLocation):
+			self.Observatory = site
+		else:
+			self.Observatory = EarthLocation.of_site(site)
+		self.altAzEngine = altAzEngine.getEngine(engine, self.Observatory)
+		self.ephemeris = ephemeris.getEphemeris(self.Observatory, cacheDir=ephemerisDir)
+		self.tileData = readTable.readTable(tileCoord)
+		RankedTileGenerator.__init__(self, skymapFile, preCompFilePrefix, dtype)
 		
-		tileObj = RankedTileGenerator(skymapFile)
-		[self.tileIndices, self.tileProbs] = tileObj.ZTF_RT()
+		self.CI = CI
+		[self.tileIndices, self.tileProbs,
+		 self.thresholdTileProb] = self.rankTiles(probability=CI)
 
 		self.tiles = SkyCoord(ra = self.tileData['ra_center'][self.tileIndices]*u.degree, 
 					    dec = self.tileData['dec_center'][self.tileIndices]*u.degree, 
@@ -363,6 +715,7 @@ class Scheduler(RankedTileGenerator):
 		self.utcoffset = utcoffset*u.hour
 
 
+	@instrumentation.instrumented('tileVisibility')
 	def tileVisibility(self, t, gps=False):
 		'''
 		METHOD	:: This method takes as input the time (gps or mjd) of observation
@@ -374,17 +727,20 @@ class Scheduler(RankedTileGenerator):
 		'''
 		if gps: time = Time(t, format='gps') ### If time is given in GPS format
 		else: time = Time(t, format='mjd') ### else time is assumed in mjd format
-		altAz_tile = self.tiles.transform_to(AltAz(obstime=time, location=self.Observatory))
-		altAz_sun = get_sun(time).transform_to(AltAz(obstime=time, location=self.Observatory))
+		frame = AltAz(obstime=time, location=self.Observatory)
+		[alt_tile, _] = self.altAzEngine.altaz(time.gps, self.tiles.ra.deg,
+											   self.tiles.dec.deg)
+		[sunAlt, sunAz] = self.ephemeris.sunAltAz(time.gps)
+		altAz_sun = SkyCoord(alt=sunAlt*u.degree, az=sunAz*u.degree, frame=frame)
 		
 		isSunDown = altAz_sun.alt.value < -18.0 ### Checks if it is past twilight.
-		whichTilesUp = altAz_tile.alt.value > 20.0  ### Checks which tiles are up		
+		whichTilesUp = alt_tile > 20.0  ### Checks which tiles are up		
 		
 # 		return [altAz_tile, self.tileProbs, altAz_sun]
 		return [self.tileIndices[whichTilesUp], self.tileProbs[whichTilesUp], altAz_sun]
 		
 
-	def advanceToSunset(self, eventTime, intTime):
+	def advanceToSunset(self, eventTime, intTime, grid=None):
 		'''
 		This method is called when the observation scheduler determines that the sun is 
 		above horizon. It finds the nearest time prior to the next sunset within +/- 
@@ -394,43 +750,87 @@ class Scheduler(RankedTileGenerator):
 		
 		eventTime	:: The GPS time for which the advancement is to be computed.
 		intTim		:: The integration time for the obsevation
+		grid		:: (optional) visibility.VisibilityGrid with step intTime. If
+					   supplied, the precomputed sun altitude track is used.
 		'''
+		if grid is not None:
+			nextDark = grid.nextDark(eventTime)
+			if nextDark is None:
+				raise ValueError('The sun does not set within 24 hours')
+			return nextDark - intTime
 		
 		dt = np.arange(0, 24*3600 + intTime, intTime)
-		time = Time(eventTime + dt, format='gps')
-		altAz_sun = get_sun(time).transform_to(AltAz(obstime=time, location=self.Observatory))
-		timeBeforeSunset = (eventTime + dt)[altAz_sun.alt.value < -18.0][0] - intTime
+		sunAlt = self.ephemeris.sunAlt(eventTime + dt)
+		timeBeforeSunset = (eventTime + dt)[sunAlt < -18.0][0] - intTime
 		return timeBeforeSunset
 
 
-	############### NOT TESTED ############
 	def whenThisTileSets(self, index, currentTime, duration, gps=False):
 		'''
-		This method approximately computes the amount of time left in seconds for a tile
-		to set below 20 degrees.
+		This method computes the time at which a tile sets below 20 degrees. The
+		setting time is solved analytically from the hour angle equation for the
+		tile declination and the site latitude (see altAzEngine.crossingTimes).
+		Returns the GPS time of the setting, or None if the tile does not set
+		within duration seconds.
 		
 		index		::	The index of the tile for which setting tile is to be found
-		currentTime	::	The current time when this tile is scheduled
+		currentTime	::	The current (GPS) time when this tile is scheduled
+		duration	::	The time window to look at in seconds
 		'''
-# 		if gps: time = Time(currentTime, format='gps')
-# 		else: time = Time(currentTime, format='mjd')
-		thisTile = SkyCoord(ra = self.tileData['ra_center'][index]*u.degree, 
-					    dec = self.tileData['dec_center'][index]*u.degree, 
-					    frame = 'icrs') ### Tile(s)
-		dt = np.arange(0, duration + 1.0, 1.0)
-		times = Time(currentTime + dt, format='gps')
-		altAz_tile = thisTile.transform_to(AltAz(obstime=times,
-												location=self.Observatory))
+		[_, setTime, _] = altAzEngine.crossingTimes(currentTime, 
+									self.tileData['ra_center'][index],
+									self.tileData['dec_center'][index],
+									self.Observatory.lat.deg,
+									self.Observatory.lon.deg, 20.0)
 		
-		setTime = None
-		if altAz_tile.alt.value[-1] < 20.0:
-			s = interpolate.UnivariateSpline(altAz_tile.alt.value, times.value, k=3)
-			setTime = s(20.0)
-			
-		return setTime
+		if np.isnan(setTime) or setTime > currentTime + duration:
+			return None
+		return float(setTime)
+
 
+	def observableIntervals(self, startTime, endTime, altLimit=20.0):
+		'''
+		METHOD	:: Returns the time intervals during which each ranked tile is 
+				   above altLimit between two GPS times, as three arrays: the 
+				   position of the tile in self.tileIndices, and the start and
+				   end GPS times of the interval. All tiles are solved at once
+				   analytically (see altAzEngine.visibleIntervals).
+		'''
+		return altAzEngine.visibleIntervals(startTime, endTime, self.tiles.ra.deg,
+											self.tiles.dec.deg,
+											self.Observatory.lat.deg,
+											self.Observatory.lon.deg, altLimit)
+
+	@instrumentation.instrumented('eventSchedule')
+	def eventSchedule(self, duration, eventTime, integrationTime=120, CI=0.99):
+		'''
+		METHOD	:: Event-driven version of observationSchedule. The ranked tiles 
+				   are kept in a priority queue that they enter when they rise,
+				   and the engine jumps directly over daytime and over times at
+				   which no tile is up (see eventScheduler.py). Nothing is printed.
+				   Returns a structured array with the fields time (GPS), tile,
+				   prob, sun_ra, sun_dec, moon_ra, moon_dec and illumination.
+				   
+		duration   		 :: Total duration of the observation in seconds.
+		eventTime  		 :: The gps time of the time of the GW trigger.
+		integrationTime  :: Time spent per tile in seconds (default == 120 seconds)
+		CI				 :: Tiles are scheduled until this probability is reached
+							(default == 0.99, as in observationSchedule). Cannot
+							exceed the CI the Scheduler was created with.
+		'''
+		if self.CI is not None and CI > self.CI:
+			raise ValueError('CI = ' + str(CI) + ' exceeds the CI of the ranked tiles ('
+							 + str(self.CI) + ')')
+		return eventScheduler.eventDrivenSchedule(self.tileIndices, self.tileProbs,
+									self.tiles.ra.deg, self.tiles.dec.deg,
+									self.Observatory, self.ephemeris, eventTime,
+									duration, integrationTime, CI)
+
+
+	@instrumentation.instrumented('observationSchedule')
 	def observationSchedule(self, duration, eventTime, integrationTime=120,
-							observedTiles=None, plot=False, verbose=False):
+							observedTiles=None, plot=False, verbose=False,
+							chunkSize=256):
 		'''
 		METHOD	:: This method takes the duration of observation, time of the GW trigger
 				   integration time per tile as input and outputs the observation
@@ -442,15 +842,17 @@ class Scheduler(RankedTileGenerator):
 		observedTiles	 :: (Future development) Array of tile indices that has been 
 							observed in an earlier epoch
 		plot			 :: (optional) Plots the tile centers that are observed.
-		verbose			 :: Toggle verbose flag for print statements.
+		verbose			 :: Print the progress messages (otherwise they are
+							logged at DEBUG level to 'rankedTilesGenerator').
+		chunkSize		 :: Number of time steps for which the tile visibility
+							is computed at once (see visibility.py).
 				   
 		
 		'''
 		
-		includeTiles = np.cumsum(self.tileProbs) < 0.99
-		includeTiles[np.sum(includeTiles)] = True
-		
-		thresholdTileProb = self.tileProbs[includeTiles][-1]
+		thresholdTileProb = self.thresholdTileProb
+		### Messages are not even formatted unless printed or logged
+		report = verbose or logger.isEnabledFor(logging.DEBUG)
 
 
 
@@ -471,67 +873,65 @@ class Scheduler(RankedTileGenerator):
 		
 		
 		
-		[_, _, altAz_sun] = self.tileVisibility(eventTime, gps=True)
+		grid = visibility.VisibilityGrid(self.tiles, self.Observatory, eventTime,
+										 integrationTime, chunkSize=chunkSize,
+										 ephemeris=self.ephemeris,
+										 engine=self.altAzEngine)
 		
-		if altAz_sun.alt.value >= -18.0:
-			if verbose: 
+		if not grid.isSunDown(eventTime):
+			if report: 
 				localTime = Time(eventTime, format='gps') + self.utcoffset
-				print str(localTime.utc.datetime) + ': Sun above the horizon'
-			eventTime = self.advanceToSunset(eventTime, integrationTime)
-			if verbose:
+				progress(verbose, str(localTime.utc.datetime) + ': Sun above the horizon')
+			eventTime = self.advanceToSunset(eventTime, integrationTime, grid)
+			if report:
 				localTime = Time(eventTime, format='gps') + self.utcoffset
-				print 'Advancing time to ' + str(localTime.utc.datetime)
-				print '\n'
+				progress(verbose, 'Advancing time to ' + str(localTime.utc.datetime))
 
 		
 		while elapsedTime <= duration: 
-			[tileIndices, tileProbs, altAz_sun] = self.tileVisibility(eventTime, gps=True)
 			localTime = Time(eventTime, format='gps') + self.utcoffset
 			
-			if altAz_sun.alt.value < -18.0: 
-				if verbose: 
-					print str(localTime.utc.datetime) + ': Observation mode'
+			if grid.isSunDown(eventTime): 
+				if report: 
+					progress(verbose, str(localTime.utc.datetime) + ': Observation mode')
+				whichTilesUp = grid.tilesUp(eventTime)
+				tileIndices = self.tileIndices[whichTilesUp]
+				tileProbs = self.tileProbs[whichTilesUp]
 				for jj in np.arange(len(tileIndices)):
 					if tileIndices[jj] not in scheduled:
 						if tileProbs[jj] > thresholdTileProb:
 							scheduled = np.append(scheduled, tileIndices[jj])
 							ObsTimes.append(localTime)
 							pVal_observed.append(tileProbs[jj])
-							Sun = get_sun(Time(eventTime, format='gps'))
-							sun_ra.append(Sun.ra.value)
-							sun_dec.append(Sun.dec.value)
-							Moon = get_moon(Time(eventTime, format='gps'))
-							sunMoonAngle = Sun.separation(Moon)
-							phaseAngle = np.arctan2(Sun.distance*np.sin(sunMoonAngle), 
-										Moon.distance - Sun.distance *
-										np.cos(sunMoonAngle))
-							illumination = 0.5*(1.0 + np.cos(phaseAngle))
+							[sunRA, sunDec] = self.ephemeris.sun(eventTime)
+							sun_ra.append(sunRA)
+							sun_dec.append(sunDec)
+							[moonRA, moonDec] = self.ephemeris.moon(eventTime)
+							illumination = self.ephemeris.illumination(eventTime)
 							
-							if verbose: print 'Lunar illumination = ' + str(illumination)
+							if report: progress(verbose, 'Lunar illumination = ' + str(illumination))
 							lunar_ilumination.append(illumination)
 							
-							moon_ra.append(Moon.ra.value)
-							moon_dec.append(Moon.dec.value)
+							moon_ra.append(moonRA)
+							moon_dec.append(moonDec)
 							observedTime += integrationTime ## Tracking observations
 							break
 				
 			else:
-				if verbose: 
+				if report: 
+					progress(verbose, str(localTime.utc.datetime) + ': Sun above the horizon')
+				eventTime = self.advanceToSunset(eventTime, integrationTime, grid)
+				if report:
 					localTime = Time(eventTime, format='gps') + self.utcoffset
-					print str(localTime.utc.datetime) + ': Sun above the horizon'
-				eventTime = self.advanceToSunset(eventTime, integrationTime)
-				if verbose:
-					localTime = Time(eventTime, format='gps') + self.utcoffset
-					print 'Advancing time to ' + str(localTime.utc.datetime)
-					print '\n'
+					progress(verbose, 'Advancing time to ' + str(localTime.utc.datetime))
 			
 
 			ii += 1
 
 			eventTime += integrationTime
 			elapsedTime += integrationTime
-			print 'elapsedTime --->' + str(elapsedTime)
-			print 'observedTime --->' + str(observedTime)
+			logger.debug('elapsedTime --->%s', elapsedTime)
+			logger.debug('observedTime --->%s', observedTime)
 
 
 	
@@ -590,7 +990,7 @@ class Scheduler(RankedTileGenerator):
 
 
 		for ii in np.arange(len(scheduled)):
-			print str(ObsTimes[ii].utc.datetime) + '\t' + str(int(scheduled[ii]))
+			print(str(ObsTimes[ii].utc.datetime) + '\t' + str(int(scheduled[ii])))
 			
 		pVal_observed = np.array(pVal_observed)
 		sun_ra = np.array(sun_ra)
@@ -617,20 +1017,71 @@ class Scheduler(RankedTileGenerator):
 ####################END OF CLASS METHODS########################
 
 
-def evolve_abs_Mag(dt, model, offset=0):	### UNDERDEVELOPMENT ###
+def topTiles(probs, probability=None, ntiles=None):
+	'''
+	METHOD		:: Returns the positions of the most probable entries of probs
+				   in decreasing order: the first ntiles, or the ones whose
+				   cumulative probability is below probability plus the next
+				   one. The candidates are found with argpartition on a
+				   growing number of entries, so only the part returned is
+				   ever sorted.
+	'''
+	n = len(probs)
+	if ntiles is not None:
+		m = min(ntiles, n)
+	elif probability is not None:
+		m = min(64, n)
+	else:
+		m = n
+	while True:
+		if m < n:
+			top = np.argpartition(-probs, m)[:m]
+		else:
+			top = np.arange(n)
+		top = top[np.argsort(-probs[top])]
+		if probability is None or m == 0:
+			return top
+		cumProb = np.cumsum(probs[top])
+		if cumProb[-1] >= probability or m == n:
+			included = np.searchsorted(cumProb, probability) ### cumProb below probability
+			return top[:min(included + 1, m)]
+		if ntiles is not None:
+			return top
+		### The missing probability needs at least this many more entries
+		last = probs[top[-1]]
+		needed = int(np.ceil((probability - cumProb[-1])/last)) if last > 0 else n
+		m = max(4*m, m + needed)
+		if m > n//4: m = n ### Partial selection no longer pays off
+
+
+def allocateTime(weights, T_obs, minTime=60.0, maxTime=1200.0):
+	'''
+	METHOD	:: Splits the total observation time between the ranked tiles in
+			   proportion to their weights (last axis; any leading axes are
+			   independent allocations), with the time per tile clipped to
+			   [minTime, maxTime]. Returns the time per tile and the mask of
+			   the tiles that fit in T_obs.
+	'''
+	weights = np.asarray(weights, dtype='float64')
+	modified_prob = weights/np.sum(weights, axis=-1)[...,None]
+	t_tiles = np.clip(modified_prob*T_obs, minTime, maxTime)
+	Obs = np.cumsum(t_tiles, axis=-1) <= T_obs ### Tiles observable in T_obs seconds
+	return [t_tiles, Obs]
+
+
+def evolve_abs_Mag(dt, model, offset=0):
 	'''
 	METHOD	:: This method takes as input the light curve model and the time
 			   since the merger and outputs the absolute magnitude of the 
-			   source.
+			   source. The model is read and fitted once (see
+			   lightCurveBank.py, which also evaluates many models at once).
 			   
 	dt 	 	:: Time since merger
 	model	:: The light curve model. Right now only one model (NSNS_MNmodel1_FRDM_r)
 	offset	:: (Optional) The offset of the peak of the light curve from the merger.
 	'''
-
-	data = np.recfromtxt(model, names=True)
-	s = interpolate.UnivariateSpline(data['time'], data['magnitude'], k=5)
-	mag = s(dt - offset)
+	bank = lightCurveBank.getLightCurveBank([model])
+	return bank.absMag(dt, offset, exact=True)
 
 	
 def gaussian_distribution_function(x, mu, sigma):
@@ -648,7 +1099,56 @@ def apparent_from_absolute_mag(absolute_mag, source_dist_parsec):
 		'''
 		return absolute_mag + 5*np.log10(source_dist_parsec/10.)
 
-def detectability(rank, time_per_tile, total_observation_time, absolute_mag, source_dist_parsec, time_data, limmag_data, error_data = None, verbose=False):
+def detectionProbability(rank, time_per_tile, total_observation_time, absolute_mag,
+						 source_dist_parsec, limmag, error=None, chunkSize=2**20):
+	'''
+	METHOD	:: Closed-form detection of a source. All of rank, time_per_tile,
+			   total_observation_time, absolute_mag and source_dist_parsec
+			   may be arrays and are broadcast against each other, so whole
+			   parameter grids are evaluated in one call. The source is
+			   detected if its tile is reached, (total_observation_time/
+			   time_per_tile) > rank, and the limiting magnitude is fainter
+			   than the apparent magnitude. If the error of the limiting
+			   magnitude is given, the limiting magnitude is gaussian and the
+			   probability of detection is its survival function,
+			   P(limmag > m) = ndtr((mu - m)/sigma). Returns a boolean
+			   (or probability) array of the broadcast shape, or a scalar if
+			   all inputs are scalars.
+
+	limmag	:: Function returning the limiting magnitude for an array of
+			   integration times (seconds)
+	error	:: (Optional) function returning the error (sigma) of the
+			   limiting magnitude for an array of integration times
+	chunkSize	:: Number of grid points evaluated at once. Bounds the memory
+				   used on top of the output array.
+	'''
+	time_per_tile = np.asarray(time_per_tile, dtype='float64')
+	flatTimes = np.atleast_1d(time_per_tile).ravel()
+	### Only evaluate the splines on the (un-broadcast) integration times
+	mu = np.asarray(limmag(flatTimes)).reshape(time_per_tile.shape)
+	if error is not None:
+		sigma = np.asarray(error(flatTimes)).reshape(time_per_tile.shape)
+	else:
+		sigma = mu
+	apparent_mag = apparent_from_absolute_mag(np.asarray(absolute_mag, dtype='float64'),
+											  np.asarray(source_dist_parsec, dtype='float64'))
+	inputs = [rank, time_per_tile, total_observation_time, mu, sigma, apparent_mag]
+	shape = np.broadcast(*inputs).shape
+	inputs = [np.broadcast_to(x, shape) for x in inputs]
+	result = np.empty(shape, dtype=bool if error is None else 'float64')
+	flatResult = result.reshape(-1)
+	for start in range(0, flatResult.size, chunkSize):
+		stop = min(start + chunkSize, flatResult.size)
+		[r, t, T, m, s, app] = [x.flat[start:stop] for x in inputs]
+		rank_reached = (T/t).astype(int) > r
+		if error is None:
+			flatResult[start:stop] = rank_reached & (m > app)
+		else:
+			flatResult[start:stop] = np.where(rank_reached, special.ndtr((m - app)/s), 0.0)
+	return result if result.ndim else result[()]
+
+@instrumentation.instrumented('detectability')
+def detectability(rank, time_per_tile, total_observation_time, absolute_mag, source_dist_parsec, time_data=None, limmag_data=None, error_data = None, verbose=False, model=None):
 	'''
 	METHOD :: This method takes as input the time allotted per tile, 
 	total observation time allotted for an event, the absolute 
@@ -673,49 +1173,28 @@ def detectability(rank, time_per_tile, total_observation_time, absolute_mag, sou
 								error_data = None, verbose=False)
 								error_data is not provided, a Boolean (True/False) for
 								detection will be output. 
+
+	The probability is computed in closed form by detectionProbability(),
+	so all of rank, time_per_tile, total_observation_time, absolute_mag and
+	source_dist_parsec can be arrays that are broadcast against each other.
+	Tiles that are not reached have zero detection probability.
+
+	model					 :: (Optional) instrumentModel.InstrumentModel to use
+								instead of fitting time_data, limmag_data and
+								error_data. The probability is returned if the
+								model has error data.
 	'''
-	### Convert to numpy object if scalar supplied
-	if isinstance(time_per_tile, (np.ndarray,)) == False:
-		time_per_tile = np.array(time_per_tile)
-	### Check if source tile rank has been reached. Return non-detection if not
-	rank_reached		= (total_observation_time/time_per_tile).astype(int)
-	rank_reached_mask	= rank_reached > rank	# True means rank is reachable
-	if np.all(~rank_reached_mask):	# if rank cannot be reached for 
-									# any integration time	
-		if verbose: print "Tile not reached in ANY allotted observation time"
-		if error_data is not None:
-			return np.zeros(len(time_per_tile))
-		else:
-			return rank_reached_mask
-
-	### Determine limiting magnitude as a function of time, via interpolation of data
-	s = interpolate.UnivariateSpline(np.log(time_data), limmag_data, k=5)
-	limmag = s(np.log(time_per_tile))
-	apparent_mag = apparent_from_absolute_mag(absolute_mag, source_dist_parsec)
-	### If error_data is not supplied, return Boolean True/False for detection
-	if error_data is None:
-		depthReached = (limmag > apparent_mag)
-		if np.any(depthReached) is False:
-			if verbose: print "Depth not reached in ANY allotted integration time"
-		return np.logical_and(depthReached, rank_reached_mask)
-		### Both Depth criteria and rank criteria should be satisfied
-	### If error_data is supplied, return detection probability
-	else:
-		s_err = interpolate.UnivariateSpline(np.log(time_data), error_data, k=5)
-		mu = limmag
-		sigma = s_err(np.log(time_per_tile))
-		very_large_number = 1000 #proxy for +infinity
-		samples = 10**5
-		x = np.linspace(apparent_mag, very_large_number, samples, endpoint = True)
-		### If floats are passed to the function, return the answer rightaway
-		if isinstance(mu, (float, np.float, np.float64,)) == True and isinstance(sigma, (float, np.float, np.float64,)) == True:
-			y = gaussian_distribution_function(x, mu, sigma)
-			return np.trapz(y,x)
-		# If an array of time_per_tile had been passed
-		# Note that mu and sigma are equal length arrays, as defined above
-		else:
-			result = []
-			for ii in range(len(mu)):
-				y = gaussian_distribution_function(x,mu[ii],sigma[ii])
-				result.append(np.trapz(y,x))
-			return np.array(result)
+	time_per_tile = np.asarray(time_per_tile, dtype='float64')
+	if verbose and np.all((total_observation_time/time_per_tile).astype(int) <= rank):
+		print("Tile not reached in ANY allotted observation time")
+
+	### Limiting magnitude (and its error) as a function of time, via interpolation of data
+	if model is None:
+		model = instrumentModel.InstrumentModel(time_data, limmag_data, error_data)
+	error = model.error if model.hasError else None
+	### Both depth criteria and rank criteria should be satisfied
+	result = detectionProbability(rank, time_per_tile, total_observation_time,
+								  absolute_mag, source_dist_parsec, model.limmag, error)
+	if verbose and error is None and not np.any(result):
+		print("Source not detected in ANY allotted integration time")
+	return result
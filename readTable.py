@@ -0,0 +1,38 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Reader for the whitespace separated text tables used throughout the package
+(tile coordinate files, light-curve models, campaign outputs), which have a
+header line of column names.
+
+"""
+
+import numpy as np
+
+
+def readTable(filename):
+	'''
+	METHOD		:: Returns the table as a structured array whose fields are
+				   named after the header line. Columns are typed from their
+				   content and text columns are returned as str. This replaces
+				   np.recfromtxt(filename, names=True), which was removed in
+				   NumPy 2.
+
+	filename	:: The table file (a path or an open file)
+	'''
+	return np.genfromtxt(filename, names=True, dtype=None, encoding=None)
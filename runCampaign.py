@@ -0,0 +1,227 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Runs the ranked tile analysis for every event of a simulation campaign
+(2016_simulated_events.asc) over a pool of worker processes. Sample usage:
+
+python runCampaign.py /path/to/simulation --output campaign.dat --nproc 16
+
+For each event the tiles are ranked (ZTF_RT), the rank of the tile containing
+the source is found (sourceTile) and the searched area and probability are
+computed (searchedArea). The results are appended to the output file as one
+whitespace separated row per event, with a header line of column names, so
+the file can be read with readTable.readTable(output). Events already
+present in the output file are skipped, which allows an interrupted campaign
+to be resumed by running the same command again. Events whose row is marked
+failed are processed again: their rows are removed from the file before the
+new rows are appended, so that every event has a single row.
+
+"""
+
+import os
+import sys
+import time
+import argparse
+import multiprocessing
+import numpy as np
+
+import rankedTilesGenerator
+import associateBNSEvents
+import tileIndex
+
+
+_settings = {}
+
+
+def _initWorker(settings):
+	'''
+	Pool initializer: stores the campaign settings and loads the tile
+	index once, so that every event processed by this worker finds it in
+	the process-wide cache.
+	'''
+	_settings.update(settings)
+	resolution = settings['preloadResolution']
+	if resolution:
+		filename = settings['preCompFilePrefix'] + str(resolution) + '.dat'
+		tileIndex.cachedTileIndex(filename, resolution)
+
+
+def processEvent(event):
+	'''
+	METHOD	:: Ranks the tiles for one event and returns the list of values
+			   of one output row (see columns()).
+
+	event	:: (eventID, ra, dec, distance, fitsFile)
+	'''
+	eventID, ra, dec, dist, fitsFile = event
+	tileCounts = _settings['tileCounts']
+	row = [eventID, ra, dec, dist]
+	try:
+		tileObj = rankedTilesGenerator.RankedTileGenerator(fitsFile,
+											_settings['preCompFilePrefix'])
+		resolution = _settings['resolution']
+		[tile_index, tile_probs] = tileObj.ZTF_RT(resolution=resolution)
+		source = tileObj.sourceTile(ra, dec, _settings['tiles'])
+		rank = np.where(tile_index == source)[0]
+		rank = int(rank[0]) if len(rank) else -1
+		[area, prob] = tileObj.searchedArea(ra, dec, resolution=resolution)
+		cumProbs = np.cumsum(tile_probs)
+		covered = [cumProbs[min(n, len(cumProbs)) - 1] for n in tileCounts]
+		row += [rank, tile_probs[rank] if rank >= 0 else np.nan, area, prob]
+		row += covered + ['ok']
+	except Exception as err:
+		sys.stderr.write('Event ' + str(eventID) + ' failed: ' + repr(err) + '\n')
+		row += [-1, np.nan, np.nan, np.nan] + [np.nan]*len(tileCounts) + ['failed']
+	return row
+
+
+def columns(tileCounts):
+	return (['eventID', 'ra', 'dec', 'distance', 'sourceTileRank',
+			 'sourceTileProb', 'searchedArea', 'searchedProb']
+			+ ['coveredProb_' + str(n) for n in tileCounts] + ['status'])
+
+
+def readEvents(path):
+	'''
+	Returns the list of (eventID, ra, dec, distance, fitsFile) of all the
+	events in the campaign, as associateBNSEvents.associate would.
+	'''
+	catalog = associateBNSEvents.getCatalog(path)
+	[ra, dec, dist, fitsFiles] = catalog.lookup(catalog.eventIDs)
+	return list(zip(catalog.eventIDs, ra, dec, dist, fitsFiles))
+
+
+def completedEvents(output):
+	'''
+	Returns the set of event IDs (as strings) already written to output,
+	leaving out the events that failed so that they are retried.
+	'''
+	done = set()
+	if not os.path.exists(output): return done
+	File = open(output, 'r')
+	for line in File:
+		if line.startswith('eventID') or not line.strip(): continue
+		values = line.split()
+		if values[-1] == 'failed': continue
+		done.add(values[0])
+	File.close()
+	return done
+
+
+def removeFailed(output):
+	'''
+	Rewrites the output file without the rows of the events that failed
+	(before they are retried). Returns the number of rows removed.
+	'''
+	if not os.path.exists(output): return 0
+	File = open(output, 'r')
+	lines = File.readlines()
+	File.close()
+	kept = [line for line in lines if not line.strip() or line.startswith('eventID')
+			or line.split()[-1] != 'failed']
+	if len(kept) == len(lines): return 0
+	### Written next to the output and renamed, so an interruption loses nothing
+	File = open(output + '.tmp', 'w')
+	File.writelines(kept)
+	File.close()
+	os.rename(output + '.tmp', output)
+	return len(lines) - len(kept)
+
+
+def preloadResolution(fitsFile, resolution, preCompFilePrefix):
+	'''
+	Returns the nside of the tile index the workers load up front: the
+	resolution used for ranking, which by default is that of the sky-maps
+	(taken from the first one). None if it cannot be read.
+	'''
+	try:
+		tileObj = rankedTilesGenerator.RankedTileGenerator(fitsFile, preCompFilePrefix)
+	except Exception:
+		return None
+	return tileObj._resolution(resolution)
+
+
+def runCampaign(path, tiles='ZTF_tiles_set1_nowrap_indexed.dat',
+				output='campaign_results.dat', nproc=None, resolution=None,
+				tileCounts=(10, 50, 100, 500),
+				preCompFilePrefix='preComputed_pixel_indices_', verbose=True):
+	'''
+	METHOD		:: Processes all events of the campaign that are not yet in
+				   the output file. Returns the throughput in events per second.
+
+	path		:: Directory with 2016_simulated_events.asc and 2016_fits/
+	tiles		:: The tile coordinate file
+	output		:: The output file (appended to if it exists)
+	nproc		:: Number of worker processes. Default is the number of cores.
+	resolution	:: The nside used for ranking (a power of 2 between 64 and 2048).
+				   Default is the sky-map resolution.
+	tileCounts	:: Numbers of top ranked tiles for which the covered probability
+				   is reported
+	'''
+	tileCounts = list(tileCounts)
+	done = completedEvents(output)
+	events = [event for event in readEvents(path) if str(event[0]) not in done]
+	if verbose:
+		print(str(len(done)) + ' events already done, ' + str(len(events)) + ' to go')
+	if not events: return 0.0
+
+	removeFailed(output)
+	settings = {'tiles': tiles, 'resolution': resolution,
+				'preloadResolution': preloadResolution(events[0][4], resolution,
+													   preCompFilePrefix),
+				'tileCounts': tileCounts, 'preCompFilePrefix': preCompFilePrefix}
+	newFile = not os.path.exists(output)
+	File = open(output, 'a')
+	if newFile:
+		File.write('\t'.join(columns(tileCounts)) + '\n')
+
+	pool = multiprocessing.Pool(nproc, _initWorker, (settings,))
+	start = time.time()
+	try:
+		for count, row in enumerate(pool.imap_unordered(processEvent, events,
+														chunksize=4), 1):
+			File.write('\t'.join([str(value) for value in row]) + '\n')
+			File.flush()
+			if verbose and count % 100 == 0:
+				rate = count/(time.time() - start)
+				print(str(count) + ' events, ' + '%.2f' % rate + ' events/s')
+	finally:
+		pool.close()
+		pool.join()
+		File.close()
+
+	rate = len(events)/(time.time() - start)
+	if verbose: print('Done: ' + '%.2f' % rate + ' events/s')
+	return rate
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Rank tiles for all events '
+									 'of a simulation campaign')
+	parser.add_argument('path', help='Directory with 2016_simulated_events.asc')
+	parser.add_argument('--tiles', default='ZTF_tiles_set1_nowrap_indexed.dat')
+	parser.add_argument('--output', default='campaign_results.dat')
+	parser.add_argument('--nproc', type=int, default=None)
+	parser.add_argument('--resolution', type=int, default=None)
+	parser.add_argument('--ntiles', type=int, nargs='+', default=[10, 50, 100, 500],
+						help='Tile counts for the covered probability columns')
+	parser.add_argument('--prefix', default='preComputed_pixel_indices_')
+	args = parser.parse_args()
+	runCampaign(args.path, tiles=args.tiles, output=args.output, nproc=args.nproc,
+				resolution=args.resolution, tileCounts=args.ntiles,
+				preCompFilePrefix=args.prefix)
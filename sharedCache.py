@@ -0,0 +1,191 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+In-process cache shared by all RankedTileGenerator (and Scheduler) objects.
+It holds the tile to pixel indices keyed on (tiling, nside) and the up/down
+graded sky-maps keyed on (sky-map, nside), so that calling several methods
+on the same event, or creating several objects for the same event, does not
+reload or regrid anything. The cache is bounded by the total size of the
+stored arrays and evicts the least recently used entries first. Memory-
+mapped arrays are not resident and do not count towards the bound. The size
+of an entry is measured again whenever it is looked up, so objects that grow
+after being stored are charged for their growth.
+
+import sharedCache
+sharedCache.getCache().stats()
+sharedCache.getCache().setMaxBytes(4 * 1024**3)
+
+"""
+
+import os
+import sys
+import mmap
+import threading
+from collections import OrderedDict
+import numpy as np
+
+
+def isMemoryMapped(array):
+	'''
+	Returns True if the buffer of a numpy array is a memory-mapped file.
+	'''
+	while array is not None:
+		if isinstance(array, (np.memmap, mmap.mmap)):
+			return True
+		array = getattr(array, 'base', None)
+	return False
+
+
+def residentBytes(array):
+	'''
+	Returns the number of bytes of an array held in memory: 0 for memory-
+	mapped arrays, whose pages belong to the file.
+	'''
+	if isMemoryMapped(array):
+		return 0
+	return int(array.nbytes)
+
+
+def sizeOf(value):
+	'''
+	Returns the size in bytes of a cached value. numpy arrays and objects
+	that define nbytes report their buffer size (0 for memory-mapped
+	arrays), lists, tuples and dictionaries the sum of their elements.
+	'''
+	if isinstance(value, np.ndarray):
+		return residentBytes(value)
+	if hasattr(value, 'nbytes'):
+		return int(value.nbytes)
+	if isinstance(value, (list, tuple)):
+		return sum([sizeOf(v) for v in value])
+	if isinstance(value, dict):
+		return sum([sizeOf(v) for v in value.values()])
+	return sys.getsizeof(value)
+
+
+class LRUCache:
+	'''
+	A least recently used cache bounded by the total number of bytes of
+	the stored values.
+
+	maxBytes	:: Upper limit on the size of the cached values in bytes
+	'''
+	def __init__(self, maxBytes=1024**3):
+		self.maxBytes = maxBytes
+		self.nbytes = 0
+		self.hits = 0
+		self.misses = 0
+		self.evictions = 0
+		self._data = OrderedDict()
+		self._lock = threading.RLock()
+
+	def __len__(self):
+		return len(self._data)
+
+	def __contains__(self, key):
+		return key in self._data
+
+	def get(self, key, default=None):
+		with self._lock:
+			if key not in self._data:
+				self.misses += 1
+				return default
+			self.hits += 1
+			value, size = self._data.pop(key) ### Re-insert as most recent
+			newSize = sizeOf(value) ### The value may have grown since
+			self._data[key] = (value, newSize)
+			self.nbytes += newSize - size
+			if newSize != size: self._evict()
+			return value
+
+	def put(self, key, value):
+		'''
+		METHOD	:: Stores value under key. Values larger than the cache limit
+				   are not stored. Returns the value.
+		'''
+		size = sizeOf(value)
+		with self._lock:
+			if key in self._data:
+				self.nbytes -= self._data.pop(key)[1]
+			if size > self.maxBytes:
+				return value
+			self._data[key] = (value, size)
+			self.nbytes += size
+			self._evict()
+		return value
+
+	def getOrCompute(self, key, func, *args, **kwargs):
+		'''
+		METHOD	:: Returns the cached value for key. On a miss the value is
+				   computed as func(*args, **kwargs) and stored.
+		'''
+		value = self.get(key, _missing)
+		if value is _missing:
+			value = self.put(key, func(*args, **kwargs))
+		return value
+
+	def setMaxBytes(self, maxBytes):
+		with self._lock:
+			self.maxBytes = maxBytes
+			self._evict()
+
+	def clear(self):
+		with self._lock:
+			self._data.clear()
+			self.nbytes = 0
+
+	def stats(self):
+		'''
+		Returns a dictionary with the hit/miss statistics and current size.
+		'''
+		lookups = self.hits + self.misses
+		return {'hits': self.hits, 'misses': self.misses,
+				'evictions': self.evictions, 'entries': len(self._data),
+				'nbytes': self.nbytes, 'maxBytes': self.maxBytes,
+				'hitRate': float(self.hits)/lookups if lookups else 0.0}
+
+	def _evict(self):
+		while self.nbytes > self.maxBytes and self._data:
+			_, (_, size) = self._data.popitem(last=False)
+			self.nbytes -= size
+			self.evictions += 1
+
+
+_missing = object()
+_cache = LRUCache()
+
+
+def getCache():
+	'''
+	Returns the cache shared by all objects in this process.
+	'''
+	return _cache
+
+
+def fileKey(filename):
+	'''
+	Returns a key identifying the current version of a file: its absolute
+	path together with its modification time and size, so that a file
+	which is overwritten is not served from the cache.
+	'''
+	path = os.path.abspath(filename)
+	try:
+		st = os.stat(path)
+		return (path, st.st_mtime, st.st_size)
+	except OSError:
+		return (path, None, None)
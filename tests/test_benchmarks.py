@@ -0,0 +1,19 @@
+import os
+import sys
+
+### Smoke test: the benchmark suite runs end to end on the smallest inputs
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+								'benchmarks'))
+
+import runBenchmarks
+
+
+def test_run_benchmarks(tmp_path):
+	report = runBenchmarks.runBenchmarks([64], str(tmp_path), repeat=1, ntiles=100,
+										 duration=3600., nproc=1)
+	names = set([result['benchmark'] for result in report['results']])
+	assert set(['ZTF_RT', 'rankTiles_0.9', 'searchedAreaBatch_1000', 'sourceTile_1000',
+				'detectability_1M', 'optimize_time_400', 'observationSchedule',
+				'eventSchedule']) <= names
+	assert all(result['best_seconds'] >= 0 for result in report['results'])
+	assert runBenchmarks.compareResults(report, report) == 0
@@ -0,0 +1,90 @@
+import tracemalloc
+
+import numpy as np
+import healpy as hp
+import pytest
+from astropy.table import Table
+
+import multiOrder
+import tileIndex
+
+
+NSIDE = 1024
+
+
+def writeMultiOrder(filename):
+	'''
+	Writes a NUNIQ sky-map: order 5 pixels over the whole sky, refined to
+	order 10 around a Gaussian peak.
+	'''
+	coarse = np.arange(hp.nside2npix(32))
+	peak = hp.ang2vec(np.deg2rad(60.0), np.deg2rad(40.0))
+	refine = np.isin(coarse, hp.query_disc(32, peak, np.deg2rad(8.0), nest=True))
+	fine = (np.repeat(coarse[refine], 4**5)*4**5
+			+ np.tile(np.arange(4**5), np.sum(refine)))
+	uniq = np.concatenate([4*4**5 + coarse[~refine], 4*4**10 + fine])
+	order, ipix = multiOrder.uniq2nest(uniq)
+	vec = np.array([hp.pix2vec(2**o, p, nest=True) for o, p in zip(order, ipix)])
+	distance = np.arccos(np.clip(np.dot(vec, peak), -1.0, 1.0))
+	probdensity = np.exp(-0.5*(distance/np.deg2rad(3.0))**2) + 1e-6
+	probdensity /= np.sum(probdensity*np.pi/(3.0*4.0**order))
+	table = Table([uniq, probdensity], names=['UNIQ', 'PROBDENSITY'])
+	table.meta['ORDERING'] = 'NUNIQ'
+	table.write(filename, format='fits')
+
+
+@pytest.fixture(scope='module')
+def moc(tmp_path_factory):
+	filename = str(tmp_path_factory.mktemp('moc') / 'moc.fits')
+	writeMultiOrder(filename)
+	assert multiOrder.isMultiOrder(filename)
+	return multiOrder.MultiOrderSkyMap(filename)
+
+
+@pytest.fixture(scope='module')
+def tiles():
+	### Overlapping circular tiles of radius 2 deg on a grid covering the sky
+	[theta, phi] = hp.pix2ang(8, np.arange(hp.nside2npix(8)))
+	vecs = hp.ang2vec(theta, phi)
+	return tileIndex.TileIndex.fromTileList([hp.query_disc(NSIDE, vec, np.deg2rad(2.0))
+											 for vec in vecs])
+
+
+def peakMemory(func):
+	tracemalloc.start()
+	result = func()
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return result, peak
+
+
+def test_range_probs_match_pixels(moc):
+	pixels = np.arange(0, hp.nside2npix(64), 7)
+	assert np.allclose(moc.rangeProbs(64, pixels, pixels + 1),
+					   moc.pixelProbs(64, pixels, nest=True))
+	### A range is the sum of its pixels
+	assert np.allclose(moc.rangeProbs(64, [100], [164]),
+					   np.sum(moc.pixelProbs(64, np.arange(100, 164), nest=True)))
+
+
+def test_nested_runs(tiles):
+	runs = tiles.nestedRuns(NSIDE, chunkSize=100000)
+	assert len(runs) == len(tiles)
+	assert np.array_equal(np.diff(runs.offsets) > 0, np.diff(tiles.offsets) > 0)
+	for ii in [0, 1, 300, len(tiles) - 1]:
+		nest = np.concatenate([np.arange(a, b) for a, b in zip(runs[ii],
+							   runs.ends[runs.offsets[ii]:runs.offsets[ii+1]])])
+		assert np.array_equal(nest, np.sort(hp.ring2nest(NSIDE, tiles[ii])))
+	assert len(runs.pixels) < len(tiles.pixels)/5
+
+
+def test_tile_sums_on_runs(moc, tiles):
+	runs = tiles.nestedRuns(NSIDE)
+	skymap = moc.rasterize(NSIDE)
+	flat, flatPeak = peakMemory(lambda: tiles.tileSums(skymap))
+	sparse, sparsePeak = peakMemory(
+				lambda: runs.sumEntries(moc.rangeProbs(NSIDE, runs.pixels, runs.ends)))
+	assert np.allclose(sparse, flat, rtol=1e-8, atol=1e-12)
+	assert np.isclose(np.sum(moc.prob), 1.0)
+	### The multi-order sums allocate per run, the flat ones per tile pixel
+	assert sparsePeak < flatPeak/2
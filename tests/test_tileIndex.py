@@ -0,0 +1,65 @@
+import pickle
+import struct
+
+import numpy as np
+import pytest
+
+import tileIndex
+
+
+class Python2Pickler(pickle._Pickler):
+	'''
+	Writes byte strings the way Python 2 pickles its str objects (BINSTRING),
+	which Python 3 decodes as ASCII unless told otherwise.
+	'''
+	dispatch = pickle._Pickler.dispatch.copy()
+
+	def save_bytes(self, obj):
+		if len(obj) < 256:
+			self.write(pickle.SHORT_BINSTRING + struct.pack('<B', len(obj)) + obj)
+		else:
+			self.write(pickle.BINSTRING + struct.pack('<i', len(obj)) + obj)
+		self.memoize(obj)
+	dispatch[bytes] = save_bytes
+
+
+def tileList():
+	### Pixel numbers above 127 put non-ASCII bytes in the array data
+	return [np.array([0, 5, 130, 255, 1000], dtype='int64'),
+			np.array([], dtype='int64'),
+			np.array([7, 200], dtype='int64')]
+
+
+@pytest.fixture
+def python2Pickle(tmp_path):
+	filename = str(tmp_path / 'preComputed_pixel_indices_64.dat')
+	File = open(filename, 'wb')
+	Python2Pickler(File, protocol=2).dump(tileList())
+	File.close()
+	return filename
+
+
+def test_python2_pickle_needs_latin1(python2Pickle):
+	File = open(python2Pickle, 'rb')
+	with pytest.raises(UnicodeDecodeError):
+		pickle.load(File)
+	File.close()
+	data = tileIndex.loadPickle(python2Pickle)
+	for pix, expected in zip(data, tileList()):
+		assert np.array_equal(pix, expected)
+
+
+def test_load_python2_pickle(python2Pickle):
+	index = tileIndex.loadTileIndex(python2Pickle)
+	assert len(index) == 3
+	for ii, expected in enumerate(tileList()):
+		assert np.array_equal(index[ii], expected)
+
+
+def test_convert_python2_pickle(python2Pickle):
+	base = tileIndex.convertPickledIndex(python2Pickle)
+	assert tileIndex.hasTileIndex(base)
+	index = tileIndex.loadTileIndex(python2Pickle)
+	assert isinstance(index.pixels, np.memmap)
+	assert np.array_equal(index.offsets, [0, 5, 5, 7])
+	assert np.array_equal(index.tileSums(np.arange(1001.0)), [1390.0, 0.0, 207.0])
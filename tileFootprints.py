@@ -0,0 +1,218 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Builds the tile to pixel indices (preComputed_pixel_indices_<nside>) for any
+telescope, given a tile center file and the field of view. Sample usage:
+
+python tileFootprints.py ZTF_tiles_set1_nowrap_indexed.dat \\
+		--polygon="-3.78,-3.62 3.78,-3.62 3.78,3.62 -3.78,3.62" --nproc 8
+
+The field of view is either a circle (--radius, in degrees) or a convex
+polygon given by its vertices in gnomonic (tangent plane) coordinates in
+degrees, x towards increasing ra and y towards increasing dec. A pixel
+belongs to a tile if its center lies inside the footprint.
+
+Only the coarsest resolution is queried directly. The pixels of finer
+resolutions are obtained by splitting the candidate pixels of the coarser
+level into their four NESTED children and testing the children, keeping
+only the children that can still intersect the footprint. The output is
+written in the memory-mapped format of tileIndex.py, in RING ordering, so
+RankedTileGenerator(skymap, preCompFilePrefix=...) can use it directly.
+
+"""
+
+import argparse
+import multiprocessing
+import numpy as np
+import healpy as hp
+
+import tileIndex
+import readTable
+
+
+class Footprint:
+	'''
+	The field of view of a telescope.
+
+	radius	:: Radius of a circular field of view in degrees
+	polygon	:: Vertices of a convex field of view, as a sequence of (x, y)
+			   gnomonic coordinates in degrees relative to the tile center
+	'''
+	def __init__(self, radius=None, polygon=None):
+		if (radius is None) == (polygon is None):
+			raise ValueError('Supply exactly one of radius and polygon')
+		self.radius = radius
+		self.polygon = None
+		if polygon is not None:
+			vertices = np.deg2rad(np.asarray(polygon, dtype='float64'))
+			x, y = vertices[:,0], vertices[:,1]
+			area = np.sum(x*np.roll(y, -1) - np.roll(x, -1)*y)
+			if area < 0: vertices = vertices[::-1] ### Counter-clockwise order
+			self.polygon = vertices
+
+	def boundingRadius(self):
+		'''
+		Returns the angular radius (radians) of a circle around the tile
+		center that contains the whole footprint.
+		'''
+		if self.polygon is None:
+			return np.deg2rad(self.radius)
+		return np.max(np.arctan(np.sqrt(np.sum(self.polygon**2, axis=1))))
+
+	def test(self, center, vec, margin):
+		'''
+		METHOD	:: Tests pixel centers against the footprint of one tile.
+				   Returns two boolean arrays: whether each pixel center is
+				   inside the footprint, and whether the pixel (of angular
+				   radius up to margin) can intersect it.
+
+		center	:: (ra, dec) of the tile center in degrees
+		vec		:: Unit vectors of the pixel centers, shape (3, N)
+		margin	:: Maximum angular radius of the pixels in radians
+		'''
+		c, e, n = _tangentBasis(center[0], center[1])
+		cosd = np.dot(c, vec)
+		if self.polygon is None:
+			dist = np.arccos(np.clip(cosd, -1.0, 1.0))
+			r = np.deg2rad(self.radius)
+			return dist <= r, dist < r + margin
+
+		front = cosd > 0
+		cosd = np.where(front, cosd, 1.0)
+		x = np.dot(e, vec)/cosd
+		y = np.dot(n, vec)/cosd
+		### Signed distance to every edge, positive inside
+		x0, y0 = self.polygon[:,0], self.polygon[:,1]
+		dx = np.roll(x0, -1) - x0
+		dy = np.roll(y0, -1) - y0
+		length = np.sqrt(dx**2 + dy**2)
+		signed = (dx[:,None]*(y[None,:] - y0[:,None])
+				  - dy[:,None]*(x[None,:] - x0[:,None]))/length[:,None]
+		dmin = np.min(signed, axis=0)
+		### The gnomonic projection stretches distances; pad the margin
+		return front & (dmin >= 0), front & (dmin > -1.5*margin)
+
+
+def _tangentBasis(ra, dec):
+	ra = np.deg2rad(ra)
+	dec = np.deg2rad(dec)
+	c = np.array([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra), np.sin(dec)])
+	e = np.array([-np.sin(ra), np.cos(ra), 0.0])
+	n = np.array([-np.sin(dec)*np.cos(ra), -np.sin(dec)*np.sin(ra), np.cos(dec)])
+	return c, e, n
+
+
+def tilePixels(footprint, ra, dec, nsides):
+	'''
+	METHOD		:: Computes the pixels (RING ordering) of one tile at every
+				   requested resolution. Returns a dictionary keyed on nside.
+
+	footprint	:: A Footprint object
+	ra, dec		:: Tile center in degrees
+	nsides		:: Resolutions (powers of 2)
+	'''
+	nsides = sorted(nsides)
+	nside = nsides[0]
+	c, _, _ = _tangentBasis(ra, dec)
+	radius = footprint.boundingRadius() + hp.max_pixrad(nside)
+	candidates = hp.query_disc(nside, c, radius, inclusive=True, nest=True)
+	result = {}
+	while True:
+		vec = np.array(hp.pix2vec(nside, candidates, nest=True))
+		inside, near = footprint.test((ra, dec), vec, hp.max_pixrad(nside))
+		if nside in nsides:
+			result[nside] = np.sort(hp.nest2ring(nside, candidates[inside]))
+		if nside >= nsides[-1]: break
+		### Descend one level in the NESTED hierarchy
+		candidates = (4*candidates[near][:,None] + np.arange(4)).ravel()
+		nside *= 2
+	return result
+
+
+def _buildChunk(args):
+	footprint, ra, dec, nsides = args
+	return [tilePixels(footprint, r, d, nsides) for r, d in zip(ra, dec)]
+
+
+def readTileCenters(tileFile):
+	'''
+	Returns the ra and dec of the tile centers ordered by tile ID, so that
+	tile index ii corresponds to ID ii + 1 (as in RankedTileGenerator.sourceTile).
+	'''
+	tileData = readTable.readTable(tileFile)
+	order = np.argsort(tileData['ID'])
+	return tileData['ra_center'][order], tileData['dec_center'][order]
+
+
+def buildTileIndex(tileFile, footprint, nsides=(64, 128, 256, 512, 1024, 2048),
+				   prefix='preComputed_pixel_indices_', nproc=None, chunksize=16):
+	'''
+	METHOD		:: Computes the pixels of every tile at every resolution and
+				   writes <prefix><nside>.pixels.npy/.offsets.npy. Returns a
+				   dictionary of the written tileIndex.TileIndex objects.
+
+	tileFile	:: The tile coordinate file (ID, ra_center, dec_center)
+	footprint	:: A Footprint object describing the field of view
+	nsides		:: Resolutions for which the index is written (powers of 2)
+	prefix		:: Prefix of the output files
+	nproc		:: Number of worker processes. Default is the number of cores.
+	chunksize	:: Number of tiles handed to a worker at a time
+	'''
+	ra, dec = readTileCenters(tileFile)
+	jobs = [(footprint, ra[ii:ii+chunksize], dec[ii:ii+chunksize], nsides)
+			for ii in range(0, len(ra), chunksize)]
+	if nproc == 1:
+		chunks = [_buildChunk(job) for job in jobs]
+	else:
+		pool = multiprocessing.Pool(nproc)
+		try:
+			chunks = pool.map(_buildChunk, jobs)
+		finally:
+			pool.close()
+			pool.join()
+	tiles = [tile for chunk in chunks for tile in chunk]
+
+	indices = {}
+	for nside in nsides:
+		index = tileIndex.TileIndex.fromTileList([tile[nside] for tile in tiles])
+		index.save(prefix + str(nside))
+		indices[nside] = index
+	return indices
+
+
+def _parsePolygon(text):
+	return [[float(v) for v in vertex.split(',')] for vertex in text.split()]
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Build tile to pixel indices '
+									 'for a tile center file')
+	parser.add_argument('tiles', help='Tile coordinate file (ID ra_center dec_center)')
+	fov = parser.add_mutually_exclusive_group(required=True)
+	fov.add_argument('--radius', type=float, help='Radius of a circular FOV in degrees')
+	fov.add_argument('--polygon', type=_parsePolygon,
+					 help='FOV vertices as "x1,y1 x2,y2 ..." in degrees')
+	parser.add_argument('--nside', type=int, nargs='+',
+						default=[64, 128, 256, 512, 1024, 2048])
+	parser.add_argument('--prefix', default='preComputed_pixel_indices_')
+	parser.add_argument('--nproc', type=int, default=None)
+	args = parser.parse_args()
+
+	footprint = Footprint(radius=args.radius, polygon=args.polygon)
+	buildTileIndex(args.tiles, footprint, nsides=args.nside, prefix=args.prefix,
+				   nproc=args.nproc)
@@ -0,0 +1,308 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Compact on-disk storage of the tile to pixel mapping used by the ranked tile
+generator. Instead of a pickled list with one array per tile, the index is
+stored as two flat numpy arrays (compressed sparse row layout):
+
+	<base>.pixels.npy	:: pixel indices of all tiles, concatenated
+	<base>.offsets.npy	:: start of every tile in the pixel array, with
+						   the total number of pixels as last element
+
+The pixels of tile ii are pixels[offsets[ii]:offsets[ii+1]]. Both files are
+memory-mapped when loaded, so opening an index costs no time and no memory.
+Existing pickles can be converted with:
+
+python tileIndex.py preComputed_pixel_indices_*.dat
+
+"""
+
+import os
+import sys
+import pickle
+import argparse
+import numpy as np
+import healpy as hp
+
+import sharedCache
+import instrumentation
+
+
+class TileIndex:
+	'''
+	The tile to pixel mapping in compressed sparse row layout. Indexing the
+	object with a tile index returns the pixels of that tile, which makes it
+	a drop-in replacement for the pickled list of arrays.
+	'''
+	def __init__(self, pixels, offsets):
+		self.pixels = pixels
+		self.offsets = offsets
+
+	@classmethod
+	def fromTileList(cls, tilePixels):
+		'''
+		METHOD		:: Builds the index from a list with one pixel array per tile
+					   (the content of the preComputed_pixel_indices_*.dat pickles)
+		'''
+		counts = np.array([len(pix) for pix in tilePixels], dtype='int64')
+		offsets = np.zeros(len(counts) + 1, dtype='int64')
+		np.cumsum(counts, out=offsets[1:])
+		if offsets[-1] > 0:
+			pixels = np.concatenate([np.asarray(pix, dtype='int64')
+									 for pix in tilePixels])
+		else:
+			pixels = np.zeros(0, dtype='int64')
+		if len(pixels) and pixels.max() < np.iinfo('int32').max:
+			pixels = pixels.astype('int32')
+		return cls(pixels, offsets)
+
+	def __len__(self):
+		return len(self.offsets) - 1
+
+	def __getitem__(self, ii):
+		return self.pixels[self.offsets[ii]:self.offsets[ii+1]]
+
+	@property
+	def nbytes(self):
+		return sharedCache.residentBytes(self.pixels) + sharedCache.residentBytes(self.offsets)
+
+	def tileSums(self, pVal):
+		'''
+		METHOD		:: Returns the sum of pVal over the pixels of every tile in
+					   a single np.add.reduceat call.
+
+		pVal		:: Pixel values of the sky-map at the resolution of the index
+		'''
+		return self.sumEntries(pVal[self.pixels])
+
+	def sumEntries(self, values):
+		'''
+		METHOD		:: Returns the sum of per-entry values (one value for each
+					   element of self.pixels) over every tile.
+		'''
+		counts = np.diff(self.offsets)
+		### A trailing zero keeps the start of empty tiles at the end in range
+		values = np.append(values, 0.0)
+		sums = np.add.reduceat(values, self.offsets[:-1])
+		sums[counts == 0] = 0.0 ### reduceat returns values[start] for empty tiles
+		return sums
+
+	def gather(self, rows):
+		'''
+		METHOD		:: Returns the concatenated entries of the given rows (tiles)
+					   and, for every entry, the position in rows it came from.
+		'''
+		rows = np.asarray(rows, dtype='int64')
+		starts = self.offsets[rows]
+		counts = self.offsets[rows + 1] - starts
+		owner = np.repeat(np.arange(len(rows)), counts)
+		### Position of every entry within its row, added to the row start
+		within = np.arange(len(owner)) - np.repeat(np.cumsum(counts) - counts, counts)
+		return self.pixels[np.repeat(starts, counts) + within], owner
+
+	def inverse(self, npix=None):
+		'''
+		METHOD		:: Returns the inverse (pixel to tile) index as a TileIndex
+					   whose rows are pixels and whose entries are the tiles
+					   containing that pixel. See cachedInverse for the cached
+					   version.
+
+		npix		:: Number of pixels of the sky-map. Default is the largest
+					   pixel index in the index plus one.
+		'''
+		if npix is None: npix = int(self.pixels.max()) + 1 if len(self.pixels) else 0
+		order = np.argsort(self.pixels, kind='mergesort')
+		tiles = np.repeat(np.arange(len(self), dtype='int32'),
+						  np.diff(self.offsets))[order]
+		### int32 offsets (4 bytes per pixel) unless there are too many entries
+		offsets = np.zeros(npix + 1, dtype='int32' if len(tiles) < 2**31 else 'int64')
+		np.cumsum(np.bincount(self.pixels, minlength=npix), out=offsets[1:])
+		return TileIndex(tiles, offsets)
+
+	def nestedRuns(self, nside, chunkSize=2**22):
+		'''
+		METHOD		:: Returns the tiles as runs of consecutive NESTED pixels
+					   (see TileRuns). A tile covers a compact region, which
+					   in NESTED ordering is a few long runs, so the runs are
+					   much fewer than the pixels. Tiles are converted a chunk
+					   at a time to bound the memory.
+
+		nside		:: The resolution of the index
+		chunkSize	:: Number of pixels converted at a time
+		'''
+		npix = 12*nside**2
+		starts, ends, counts = [], [], []
+		first = 0
+		while first < len(self):
+			### At least one tile per chunk, however large
+			last = max(int(np.searchsorted(self.offsets, self.offsets[first] + chunkSize,
+											side='right')) - 1, first + 1)
+			last = min(last, len(self))
+			lo, hi = self.offsets[first], self.offsets[last]
+			owner = np.repeat(np.arange(last - first, dtype='int64'),
+							  np.diff(self.offsets[first:last+1]))
+			key = owner*npix + hp.ring2nest(nside, np.asarray(self.pixels[lo:hi], dtype='int64'))
+			key.sort()
+			owner = key//npix
+			nest = key - owner*npix
+			### A run starts at a new tile or after a gap in the pixel numbers
+			isStart = np.ones(len(key), dtype=bool)
+			isStart[1:] = (owner[1:] != owner[:-1]) | (nest[1:] != nest[:-1] + 1)
+			begin = np.flatnonzero(isStart)
+			starts.append(nest[begin])
+			ends.append(nest[np.append(begin[1:], len(key)) - 1] + 1)
+			counts.append(np.bincount(owner[begin], minlength=last - first))
+			first = last
+		offsets = np.zeros(len(self) + 1, dtype='int64')
+		if counts: np.cumsum(np.concatenate(counts), out=offsets[1:])
+		starts = np.concatenate(starts) if starts else np.zeros(0, dtype='int64')
+		ends = np.concatenate(ends) if ends else np.zeros(0, dtype='int64')
+		return TileRuns(starts, offsets, ends)
+
+	def save(self, base):
+		'''
+		METHOD		:: Writes the index to <base>.pixels.npy and <base>.offsets.npy
+		'''
+		np.save(base + '.pixels.npy', np.asarray(self.pixels))
+		np.save(base + '.offsets.npy', np.asarray(self.offsets))
+
+
+class TileRuns(TileIndex):
+	'''
+	The tiles as runs of consecutive NESTED pixels: the entries of tile ii
+	(self[ii]) are the first pixels of its runs and ends holds, for every
+	run, the pixel following its last one. Built by TileIndex.nestedRuns.
+	'''
+	def __init__(self, pixels, offsets, ends):
+		TileIndex.__init__(self, pixels, offsets)
+		self.ends = ends
+
+	@property
+	def nbytes(self):
+		return TileIndex.nbytes.fget(self) + sharedCache.residentBytes(self.ends)
+
+
+def loadPickle(filename):
+	'''
+	Returns the content of a pickle file. The tile indices and catalogs were
+	pickled with Python 2, whose numpy arrays can only be read by Python 3
+	with the latin1 encoding.
+	'''
+	File = open(filename, 'rb')
+	try:
+		if sys.version_info[0] >= 3:
+			return pickle.load(File, encoding='latin1')
+		return pickle.load(File)
+	finally:
+		File.close()
+
+
+def indexBase(filename):
+	'''
+	Returns the base name of the memory-mapped index belonging to a pickled
+	index file, i.e. preComputed_pixel_indices_512.dat -> preComputed_pixel_indices_512
+	'''
+	root, ext = os.path.splitext(filename)
+	if ext in ('.dat', '.npy'): return root
+	return filename
+
+
+def hasTileIndex(base):
+	return os.path.exists(base + '.pixels.npy') and os.path.exists(base + '.offsets.npy')
+
+
+@instrumentation.instrumented('tile_index_load')
+def loadTileIndex(filename, mmap_mode='r'):
+	'''
+	METHOD		:: Loads the tile to pixel index. If the memory-mapped version
+				   of the file exists it is used, otherwise the pickled list
+				   is read and converted in memory.
+
+	filename	:: The pickled index file (preComputed_pixel_indices_<nside>.dat)
+				   or the base name of the memory-mapped index.
+	mmap_mode	:: Passed to np.load. Use None to read the arrays into memory.
+	'''
+	base = indexBase(filename)
+	if hasTileIndex(base):
+		pixels = np.load(base + '.pixels.npy', mmap_mode=mmap_mode)
+		offsets = np.load(base + '.offsets.npy', mmap_mode=mmap_mode)
+		return TileIndex(pixels, offsets)
+
+	data = loadPickle(filename)
+	return TileIndex.fromTileList(data)
+
+
+def cachedTileIndex(filename, nside):
+	'''
+	METHOD		:: Returns the tile to pixel index from the process-wide cache
+				   (see sharedCache.py), loading it on first use.
+
+	filename	:: The index file as passed to loadTileIndex
+	nside		:: The resolution of the index (part of the cache key)
+	'''
+	key = ('tiles', sharedCache.fileKey(filename), nside)
+	return sharedCache.getCache().getOrCompute(key, loadTileIndex, filename)
+
+
+def cachedInverse(filename, nside):
+	'''
+	METHOD		:: Returns the inverse (pixel to tile) index of a tiling from
+				   the process-wide cache. It is stored as its own entry, so
+				   that it is accounted for (and evicted) separately from the
+				   index.
+	'''
+	key = ('inverse', sharedCache.fileKey(filename), nside)
+	return sharedCache.getCache().getOrCompute(key, _buildInverse, filename, nside)
+
+
+def _buildInverse(filename, nside):
+	return cachedTileIndex(filename, nside).inverse(12*nside**2)
+
+
+def cachedRuns(filename, nside):
+	'''
+	METHOD		:: Returns the tiles of a tiling as runs of NESTED pixels (see
+				   TileIndex.nestedRuns) from the process-wide cache.
+	'''
+	key = ('runs', sharedCache.fileKey(filename), nside)
+	return sharedCache.getCache().getOrCompute(key, _buildRuns, filename, nside)
+
+
+def _buildRuns(filename, nside):
+	return cachedTileIndex(filename, nside).nestedRuns(nside)
+
+
+def convertPickledIndex(filename, base=None):
+	'''
+	METHOD		:: Converts a pickled preComputed_pixel_indices_<nside>.dat file
+				   to the memory-mapped format. Returns the base name written.
+	'''
+	if base is None: base = indexBase(filename)
+	data = loadPickle(filename)
+	TileIndex.fromTileList(data).save(base)
+	return base
+
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description='Convert pickled tile pixel '
+									 'indices to the memory-mapped format')
+	parser.add_argument('files', nargs='+', help='preComputed_pixel_indices_*.dat files')
+	args = parser.parse_args()
+	for filename in args.files:
+		base = convertPickledIndex(filename)
+		print('Wrote ' + base + '.pixels.npy and ' + base + '.offsets.npy')
@@ -0,0 +1,106 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Spatial index of the tile centers of a tiling, used to find the tile of a
+source position. The tile centers are put in a KD-tree of unit vectors once
+per tiling file, after which arrays of positions are located in one call:
+
+locator = tileLocator.getTileLocator('ZTF_tiles_set1_nowrap_indexed.dat')
+tiles = locator.nearest(ra, dec)
+
+For overlapping tilings, containing() returns every tile whose footprint
+contains a position, using the tile to pixel index (see tileIndex.py).
+
+"""
+
+import numpy as np
+import healpy as hp
+from scipy.spatial import cKDTree
+
+import sharedCache
+import readTable
+
+
+def radec2vec(ra, dec):
+	'''
+	Returns the unit vectors (N, 3) of positions given in degrees.
+	'''
+	ra = np.deg2rad(np.atleast_1d(ra))
+	dec = np.deg2rad(np.atleast_1d(dec))
+	return np.column_stack([np.cos(dec)*np.cos(ra), np.cos(dec)*np.sin(ra),
+							np.sin(dec)])
+
+
+class TileLocator:
+	'''
+	KD-tree on the unit vectors of the tile centers.
+
+	tiles	:: The tile coordinate file (ID, ra_center, dec_center)
+	'''
+	def __init__(self, tiles):
+		tileData = readTable.readTable(tiles)
+		self.ID = tileData['ID']
+		self.ra_center = tileData['ra_center']
+		self.dec_center = tileData['dec_center']
+		self.tree = cKDTree(radec2vec(self.ra_center, self.dec_center))
+
+	@property
+	def nbytes(self):
+		### The tree holds a copy of the vectors plus its nodes
+		return (2*self.tree.data.nbytes + self.ID.nbytes + self.ra_center.nbytes
+				+ self.dec_center.nbytes)
+
+	def nearest(self, ra, dec):
+		'''
+		METHOD	:: Returns the index (ID - 1) of the tile whose center is
+				   closest to each position. Scalars in, scalar out.
+
+		ra		:: Right ascension(s) of the source(s) in degrees
+		dec		:: Declination(s) of the source(s) in degrees
+		'''
+		_, index = self.tree.query(radec2vec(ra, dec))
+		tiles = self.ID[index] - 1 ### Since the indexing begins with 1.
+		if np.ndim(ra) == 0 and np.ndim(dec) == 0: return tiles[0]
+		return tiles
+
+	def containing(self, ra, dec, inverse, nside):
+		'''
+		METHOD	:: Finds all tiles whose footprint contains each position.
+				   Returns two arrays of equal length: the position number and
+				   the tile index of every (position, tile) pair.
+
+		ra		:: Right ascension(s) of the source(s) in degrees
+		dec		:: Declination(s) of the source(s) in degrees
+		inverse	:: The pixel to tile index of the tiling (see
+				   tileIndex.cachedInverse)
+		nside	:: The resolution of the index
+		'''
+		theta = 0.5*np.pi - np.deg2rad(np.atleast_1d(dec))
+		phi = np.deg2rad(np.atleast_1d(ra))
+		pixels = hp.ang2pix(nside, theta, phi)
+		tiles, which = inverse.gather(pixels)
+		return [which, tiles]
+
+
+def getTileLocator(tiles):
+	'''
+	Returns the TileLocator of a tiling file from the process-wide cache,
+	building it on first use.
+	'''
+	key = ('locator', sharedCache.fileKey(tiles))
+	return sharedCache.getCache().getOrCompute(key, TileLocator, tiles)
@@ -0,0 +1,135 @@
+# Copyright (C) 2017 Shaon Ghosh, David Kaplan, Shasvath Kapadia, Deep Chatterjee
+#
+# This program is free software; you can redistribute it and/or modify it
+# under the terms of the GNU General Public License as published by the
+# Free Software Foundation; either version 2 of the License, or (at your
+# option) any later version.
+#
+# This program is distributed in the hope that it will be useful, but
+# WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+# Public License for more details.
+#
+# You should have received a copy of the GNU General Public License along
+# with this program; if not, write to the Free Software Foundation, Inc.,
+# 51 Franklin Street, Fifth Floor, Boston, MA  02110-1301, USA.
+
+"""
+
+Precomputed visibility of the ranked tiles for the Scheduler. The scheduler
+only ever looks at times startTime + k*step (k = 0, 1, ...), so the altitude
+of all tiles and of the sun is computed for whole blocks of these time slots
+with one vectorized AltAz transform per block, and every per-step visibility
+or twilight check becomes an array lookup. Blocks of tile altitudes are
+computed on demand and only the current block is kept, which bounds the
+memory for long observing windows; the sun altitude track is kept for all
+blocks since it is one number per slot.
+
+"""
+
+import numpy as np
+from astropy.time import Time
+from astropy.coordinates import get_sun, AltAz
+
+import instrumentation
+
+
+class VisibilityGrid:
+	'''
+	Tile and sun altitudes on the time grid startTime + k*step.
+
+	tiles		 :: SkyCoord of the ranked tiles
+	location	 :: EarthLocation of the observatory
+	startTime	 :: GPS time of the first slot
+	step		 :: Spacing of the slots in seconds (the integration time)
+	chunkSize	 :: Number of time slots computed at once
+	tileAltLimit :: Tiles above this altitude (degrees) are observable
+	sunAltLimit	 :: The sun must be below this altitude (degrees)
+	ephemeris	 :: (optional) ephemeris.Ephemeris of the site. If given, the
+					sun altitude is interpolated from its tables.
+	engine		 :: (optional) alt/az engine from altAzEngine.py used for the
+					tile altitudes. Default is the astropy AltAz transform.
+	'''
+	def __init__(self, tiles, location, startTime, step, chunkSize=256,
+				 tileAltLimit=20.0, sunAltLimit=-18.0, ephemeris=None, engine=None):
+		self.tiles = tiles
+		self.location = location
+		self.startTime = startTime
+		self.step = step
+		self.chunkSize = chunkSize
+		self.tileAltLimit = tileAltLimit
+		self.sunAltLimit = sunAltLimit
+		self.ephemeris = ephemeris
+		self.engine = engine
+		self._sunAlt = {}
+		self._tileChunk = None
+		self._tilesUp = None
+
+	def _times(self, chunk):
+		k = chunk*self.chunkSize + np.arange(self.chunkSize)
+		return Time(self.startTime + k*self.step, format='gps')
+
+	def slot(self, t):
+		'''
+		Returns the slot number of GPS time t.
+		'''
+		return int(round((t - self.startTime)/float(self.step)))
+
+	def _sunChunk(self, chunk):
+		if chunk not in self._sunAlt and self.ephemeris is not None:
+			k = chunk*self.chunkSize + np.arange(self.chunkSize)
+			self._sunAlt[chunk] = self.ephemeris.sunAlt(self.startTime + k*self.step)
+		if chunk not in self._sunAlt:
+			with instrumentation.stage('visibility_sun'):
+				times = self._times(chunk)
+				frame = AltAz(obstime=times, location=self.location)
+				self._sunAlt[chunk] = get_sun(times).transform_to(frame).alt.value
+		return self._sunAlt[chunk]
+
+	def sunAlt(self, t):
+		'''
+		Returns the altitude of the sun (degrees) at GPS time t.
+		'''
+		k = self.slot(t)
+		return self._sunChunk(k // self.chunkSize)[k % self.chunkSize]
+
+	def isSunDown(self, t):
+		return self.sunAlt(t) < self.sunAltLimit
+
+	def tilesUp(self, t):
+		'''
+		Returns a boolean array telling which tiles are above the altitude
+		limit at GPS time t.
+		'''
+		k = self.slot(t)
+		chunk = k // self.chunkSize
+		if chunk != self._tileChunk:
+			with instrumentation.stage('visibility_tiles'):
+				times = self._times(chunk)
+				if self.engine is not None:
+					[alt, _] = self.engine.altaz(times.gps[:,None], self.tiles.ra.deg[None,:],
+												 self.tiles.dec.deg[None,:])
+				else:
+					frame = AltAz(obstime=times.reshape(-1, 1), location=self.location)
+					alt = self.tiles.reshape(1, -1).transform_to(frame).alt.value
+				self._tilesUp = alt > self.tileAltLimit
+				self._tileChunk = chunk
+		return self._tilesUp[k % self.chunkSize]
+
+	def nextDark(self, t, maxTime=24*3600.):
+		'''
+		Returns the first slot time at or after GPS time t at which the sun
+		is below the limit, looking ahead at most maxTime seconds. Returns
+		None if there is none.
+		'''
+		k = self.slot(t)
+		last = self.slot(t + maxTime)
+		while k <= last:
+			chunk = k // self.chunkSize
+			sunAlt = self._sunChunk(chunk)[k % self.chunkSize:]
+			dark = np.nonzero(sunAlt < self.sunAltLimit)[0]
+			if len(dark):
+				k += dark[0]
+				return self.startTime + k*self.step if k <= last else None
+			k = (chunk + 1)*self.chunkSize
+		return None